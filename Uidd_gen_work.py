@@ -19,26 +19,38 @@ import shutil
 import time
 import subprocess
 import platform
-import requests
 import psutil
 import json
 import urllib.parse
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Tuple
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+from adaptive_timeout import AdaptiveTimeout
+from combo_filter import ComboHistory, select_combinations
+from port_pool import PORT_LAST, PortPool
+from results_store import ResultsWriter
+from shard_pool import run_sharded, shard_count
+from socks_probe import probe_batch
+from vless_parse import clean_url, parse as parse_record, xray_fields
+import xray_ready
 
 # ------------------------------- НАСТРОЙКИ -------------------------------
 INPUT_FILE        = "sidr_vless.txt"
 OUTPUT_FILE       = "Wow_work_uidd.txt"
 TEST_DOMAIN       = "https://www.google.com/generate_204"
-TIMEOUT           = 30
-TEST_THREADS      = 500          # сколько потоков для запуска батчей xray
+TIMEOUT           = 30           # потолок; рабочий таймаут — по задержкам живых (adaptive_timeout.py)
+MIN_TIMEOUT       = 5.0
+TEST_THREADS      = 32           # сколько батчей xray работает одновременно
 PROXIES_PER_BATCH = 200
-LOCAL_PORT_START  = 10000
-CORE_STARTUP_TIMEOUT = 4.0
+BATCH_PROBE_CONCURRENCY = 100    # одновременных проверок внутри одного батча
+BATCH_DEADLINE    = TIMEOUT + 10 # общий лимит на проверку батча, потом xray гасится
+LOCAL_PORT_START  = 10000        # начало пула портов inbound'ов (port_pool.py)
+SHARDS            = 0            # процессов проверки (shard_pool.py): 0 — по числу ядер, 1 — всё в этом процессе
+CORE_STARTUP_TIMEOUT = 4.0       # потолок, как и TIMEOUT
+MIN_STARTUP_TIMEOUT  = 1.0
 CORE_KILL_DELAY   = 0.05
 MAX_CONCURRENT_CHECKS = 500     # ограничение параллельных проверок портов
+TOP_K_PER_TAIL    = 100          # сколько UUID пробовать на хвост (по рангу из истории); None — все
 
 # ------------------------------- RICH -------------------------------
 try:
@@ -52,94 +64,54 @@ except ImportError:
 
 logger = console
 
-# ------------------------------- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ -------------------------------
-def clean_url(url: str) -> str:
-    return url.strip().replace('\ufeff', '').replace('\u200b', '').replace('\n', '').replace('\r', '')
-
-REALITY_PBK_RE = re.compile(r"^[A-Za-z0-9_-]{43,44}$")
-REALITY_SID_RE = re.compile(r"^[0-9a-fA-F]{0,32}$")
-FLOW_ALLOWED = {"", "xtls-rprx-vision", "xtls-rprx-direct", "xtls-rprx-splice"}
-
 # ------------------------------- ПАРСЕР VLESS -------------------------------
 def parse_vless(url: str):
-    try:
-        url = clean_url(url)
-        if not url.startswith("vless://"):
-            return None
-        if '#' in url:
-            main_part, tag_raw = url.split('#', 1)
-            tag = urllib.parse.unquote(tag_raw).strip()
-        else:
-            main_part = url
-            tag = "vless"
-
-        parsed_url = urllib.parse.urlparse(main_part)
-        uuid = urllib.parse.unquote(parsed_url.username or "")
-        address = parsed_url.hostname or ""
-        port = parsed_url.port or 443
-        if not uuid or not address:
-            return None
-
-        query_params = urllib.parse.parse_qs(parsed_url.query)
-
-        def get_p(key, default=""):
-            return query_params.get(key, [default])[0].strip()
-
-        encryption = get_p("encryption", "none").lower()
-        net_type = get_p("type", "tcp").lower()
-        if net_type in ["ws", "websocket"]:     net_type = "ws"
-        elif net_type in ["grpc", "gun"]:       net_type = "grpc"
-        elif net_type in ["http", "h2", "httpupgrade"]: net_type = "http"
-        else:                                   net_type = "tcp"
-
-        flow = get_p("flow", "").lower()
-        if flow not in FLOW_ALLOWED:
-            flow = ""
-
-        security = get_p("security", "none").lower()
-        if security not in ["tls", "reality", "none"]:
-            security = "none"
-
-        pbk = get_p("pbk", "")
-        if pbk and REALITY_PBK_RE.match(pbk):
-            if security != "reality":
-                security = "reality"
-        else:
-            pbk = ""
-
-        sid = re.sub(r"[^a-fA-F0-9]", "", get_p("sid", ""))
-        if len(sid) > 32 or len(sid) % 2 != 0:
-            sid = ""
-        if sid and not REALITY_SID_RE.match(sid):
-            sid = ""
-
-        sni = get_p("sni", "") or address
-        fp = get_p("fp", "chrome")
-        alpn_str = get_p("alpn", "")
-        alpn = [x.strip() for x in alpn_str.split(",")] if alpn_str else []
-
-        return {
-            "protocol": "vless",
-            "uuid": uuid.lower(),
-            "address": address,
-            "port": port,
-            "flow": flow,
-            "security": security,
-            "encryption": encryption,
-            "pbk": pbk,
-            "sid": sid,
-            "sni": sni,
-            "fp": fp,
-            "alpn": alpn,
-            "type": net_type,
-            "host": get_p("host", ""),
-            "path": urllib.parse.unquote(get_p("path", "")),
-            "serviceName": get_p("serviceName", ""),
-            "headerType": get_p("headerType", "none"),
-            "tag": tag
-        }
-    except Exception:
+    # Разбор строки — общий и кэшированный (vless_parse), здесь только нормализация полей
+    rec = parse_record(url)
+    if rec is None or not rec.uuid or not rec.address:
+        return None
+    get_p = rec.param
+
+    encryption = get_p("encryption", "none").lower()
+    net_type = get_p("type", "tcp").lower()
+    if net_type in ["ws", "websocket"]:     net_type = "ws"
+    elif net_type in ["grpc", "gun"]:       net_type = "grpc"
+    elif net_type in ["http", "h2", "httpupgrade"]: net_type = "http"
+    else:                                   net_type = "tcp"
+
+    # flow/security/pbk/sid — по общему с work_test правилу (vless_parse.xray_fields)
+    fields = xray_fields(rec)
+    if fields is None:
         return None
+    flow, security, pbk, sid = fields
+    if pbk and security != "reality":
+        security = "reality"
+
+    sni = get_p("sni", "") or rec.address
+    fp = get_p("fp", "chrome")
+    alpn_str = get_p("alpn", "")
+    alpn = [x.strip() for x in alpn_str.split(",")] if alpn_str else []
+
+    return {
+        "protocol": "vless",
+        "uuid": rec.uuid.lower(),
+        "address": rec.address,
+        "port": rec.port,
+        "flow": flow,
+        "security": security,
+        "encryption": encryption,
+        "pbk": pbk,
+        "sid": sid,
+        "sni": sni,
+        "fp": fp,
+        "alpn": alpn,
+        "type": net_type,
+        "host": get_p("host", ""),
+        "path": urllib.parse.unquote(get_p("path", "")),
+        "serviceName": get_p("serviceName", ""),
+        "headerType": get_p("headerType", "none"),
+        "tag": rec.tag if rec.tag is not None else "vless"
+    }
 
 def extract_uuid(vless: str) -> str | None:
     match = re.search(r'vless://([^@]+)@', vless)
@@ -198,7 +170,12 @@ def make_outbound(parsed, tag: str):
     }
 
 # ------------------------------- СОЗДАНИЕ КОНФИГА БАТЧА -------------------------------
-def create_batch_config_file(proxy_list: List[str], start_port: int, work_dir: str):
+def create_batch_config_file(proxy_list: List[str], start_port: int, work_dir: str,
+                             parse=None, outbound_factory=None):
+    # parse / outbound_factory позволяют другим скриптам (work_test.py) собирать
+    # батч из своих парсеров, сохраняя ту же схему inbound -> outbound
+    parse = parse or parse_vless
+    outbound_factory = outbound_factory or make_outbound
     inbounds = []
     outbounds = []
     rules = []
@@ -217,8 +194,8 @@ def create_batch_config_file(proxy_list: List[str], start_port: int, work_dir: s
             "settings": {"udp": False}
         })
 
-        parsed = parse_vless(url)
-        outbound = make_outbound(parsed, out_tag)
+        parsed = parse(url)
+        outbound = outbound_factory(parsed, out_tag)
         if outbound:
             outbounds.append(outbound)
             rules.append({"type": "field", "inboundTag": [in_tag], "outboundTag": out_tag})
@@ -228,7 +205,7 @@ def create_batch_config_file(proxy_list: List[str], start_port: int, work_dir: s
         return None, None
 
     config = {
-        "log": {"loglevel": "none"},
+        "log": xray_ready.XRAY_LOG,   # строка «Xray ... started» нужна xray_ready
         "inbounds": inbounds,
         "outbounds": outbounds,
         "routing": {"rules": rules, "domainStrategy": "AsIs"}
@@ -255,10 +232,20 @@ def run_core(core_path: str, config_path: str):
     if startupinfo:
         startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
     try:
-        return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, startupinfo=startupinfo)
+        return xray_ready.start(cmd, startupinfo=startupinfo)
     except:
         return None
 
+def poll_core_ports(port: int, timeout: float) -> bool:
+    """Запасной путь для xray_ready: опрос первого inbound'а + пауза на остальные."""
+    deadline = time.perf_counter() + timeout
+    while not is_port_in_use(port):
+        if time.perf_counter() >= deadline:
+            return False
+        time.sleep(0.05)
+    time.sleep(0.4)
+    return True
+
 def kill_core(proc):
     if not proc:
         return
@@ -270,22 +257,6 @@ def kill_core(proc):
     except:
         pass
 
-# ------------------------------- ПРОВЕРКА СОЕДИНЕНИЯ -------------------------------
-def check_connection(port: int) -> Tuple[bool | int, str | None]:
-    proxies = {
-        'http':  f'socks5://127.0.0.1:{port}',
-        'https': f'socks5://127.0.0.1:{port}'
-    }
-    try:
-        start = time.time()
-        r = requests.get(TEST_DOMAIN, proxies=proxies, timeout=TIMEOUT, verify=False)
-        latency = round((time.time() - start) * 1000)
-        if r.status_code == 204:
-            return latency, None
-        return False, f"HTTP {r.status_code}"
-    except Exception as e:
-        return False, str(e)[:40]
-
 # ------------------------------- ПРОВЕРКА ОТКРЫТОГО ПОРТА (асинхронно) -------------------------------
 async def check_vless_port_open(vless_str: str, sem: asyncio.Semaphore, timeout: float = 3.0) -> bool:
     async with sem:
@@ -338,16 +309,30 @@ def compare_parsed(a, b):
         _are_equal(a.get("sid"),         b.get("sid"))
     )
 
+# Поля compare_parsed, кроме port и alpn (host игнорируется, как в v2rayN)
+IDENTITY_FIELDS = ("protocol", "address", "uuid", "encryption", "type", "headerType",
+                   "path", "security", "flow", "sni", "fp", "pbk", "sid")
+
+def dedup_identity(parsed):
+    """Хэшируемый ключ: равен у двух конфигов тогда и только тогда, когда compare_parsed их склеивает.
+
+    Пустые значения ("", None, []) сводятся к None, как в _are_equal; port сравнивается как есть.
+    """
+    return ((parsed.get("port"), tuple(parsed.get("alpn") or ()))
+            + tuple(parsed.get(k) or None for k in IDENTITY_FIELDS))
+
 def deduplicate_proxies(proxies_with_latency: List[Tuple[str, int]]):
     keep = []
+    seen = set()
     removed = 0
     for url, latency in proxies_with_latency:
         parsed = parse_vless(url)
         if not parsed:
             keep.append((url, latency))
             continue
-        exists = any(compare_parsed(parse_vless(k_url), parsed) for k_url, _ in keep)
-        if not exists:
+        key = dedup_identity(parsed)
+        if key not in seen:
+            seen.add(key)
             keep.append((url, latency))
         else:
             removed += 1
@@ -356,6 +341,85 @@ def deduplicate_proxies(proxies_with_latency: List[Tuple[str, int]]):
 # =============================================================================
 # ОСНОВНАЯ ЛОГИКА
 # =============================================================================
+# ------------------------------- ТЕСТИРОВАНИЕ ЧЕРЕЗ XRAY -------------------------------
+def test_configs(shard, configs, ports, emit, core_path, temp_dir, threads):
+    """Проверяет configs батчами xray в threads потоках, порты — из [ports[0], ports[1]).
+
+    Наружу всё уходит через emit (сообщения одинаковы в одном процессе и в шарде
+    shard_pool.py): ("advance", n), ("probe", url, задержка или None, ошибка),
+    в конце ("summary", [строки сводки]).
+    """
+    http_timeout = AdaptiveTimeout("проверка", TIMEOUT, MIN_TIMEOUT)
+    startup_timeout = AdaptiveTimeout("старт xray", CORE_STARTUP_TIMEOUT, MIN_STARTUP_TIMEOUT)
+    port_pool = PortPool(*ports)
+
+    def test_batch(chunk):
+        # Порты батча — из пула: свободные по bind, возвращаются после выхода xray
+        lease = port_pool.acquire(len(chunk))
+        proc = None
+        cfg_path = None
+        try:
+            cfg_path, mapping = create_batch_config_file(chunk, lease.start, temp_dir)
+            if not mapping:
+                emit(("advance", len(chunk)))
+                return
+
+            proc = run_core(core_path, cfg_path)
+            if not proc:
+                emit(("advance", len(chunk)))
+                return
+
+            # Готовность — по строке запуска xray (xray_ready), опрос портов — запасной путь
+            start_limit = startup_timeout.get()
+            start_t = time.perf_counter()
+            started = xray_ready.wait_ready(
+                proc, start_limit, lambda remaining: poll_core_ports(mapping[0][1], remaining))
+
+            if started:
+                startup_timeout.observe(time.perf_counter() - start_t, start_limit)
+            else:
+                if not xray_ready.exited(proc):
+                    startup_timeout.timed_out(start_limit)
+                for url, _, _ in mapping:
+                    emit(("probe", url, None, "core"))
+                emit(("advance", len(chunk)))
+                return
+
+            # Все inbound'ы батча проверяются одновременно; после общего дедлайна
+            # недопроверенные считаются мёртвыми, и xray сразу гасится
+            timeout = http_timeout.get()
+            results = asyncio.run(probe_batch(
+                [port for _, port, _ in mapping], TEST_DOMAIN, timeout,
+                concurrency=BATCH_PROBE_CONCURRENCY, deadline=timeout + BATCH_DEADLINE - TIMEOUT,
+                on_result=lambda r: emit(("advance", 1)),
+            ))
+            if any(r["error"] in ("timeout", "batch deadline") for r in results):
+                http_timeout.timed_out(timeout)
+
+            for (url, port, parsed), r in zip(mapping, results):
+                emit(("probe", url, r["latency"] if r["ok"] else None, r["error"]))
+                if r["ok"]:
+                    http_timeout.observe(r["latency"] / 1000, timeout)
+            if len(chunk) > len(mapping):
+                emit(("advance", len(chunk) - len(mapping)))
+        finally:
+            if proc:
+                kill_core(proc)
+                time.sleep(CORE_KILL_DELAY)
+            lease.release(proc)
+            if cfg_path:
+                try:
+                    os.remove(cfg_path)
+                except:
+                    pass
+
+    chunks = [configs[i:i + PROXIES_PER_BATCH] for i in range(0, len(configs), PROXIES_PER_BATCH)]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(test_batch, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            future.result()
+    emit(("summary", [http_timeout.summary(), startup_timeout.summary(), xray_ready.summary(), port_pool.summary()]))
+
 async def main():
     logger.print("[bold cyan]=== Генератор + Тестер VLESS-конфигов (2025) ===[/]\n")
 
@@ -399,19 +463,23 @@ async def main():
         logger.print("[bold red]Не найдено ни одного сервера с открытым портом. Выход.[/]")
         return
 
-    # 4. Генерация новых конфигов
+    # 4. Генерация новых конфигов: UUID × хвост, ранжированные по истории прошлых запусков
     logger.print("\n[cyan]Генерация новых конфигов...[/]")
-    new_configs = []
+    history = ComboHistory()
+    history.load_backups()
+    originals = []
     for original in working_original:
         tail = extract_tail(original)
-        if not tail:
-            continue
-        orig_uuid = extract_uuid(original)
-        for new_uuid in unique_uuids:
-            if new_uuid == orig_uuid:
-                continue
-            new_vless = f"vless://{new_uuid}@{tail}"
-            new_configs.append(new_vless)
+        if tail:
+            originals.append((extract_uuid(original), tail))
+    new_configs, combo_stats = select_combinations(originals, unique_uuids, history, TOP_K_PER_TAIL)
+
+    known = combo_stats["known"]
+    logger.print(f"[cyan]Комбинаций всего: {combo_stats['generated']:,}, после предотбора: {combo_stats['kept']:,} "
+                 f"(не больше {TOP_K_PER_TAIL} на хвост), серверов отброшено: {combo_stats['servers_dropped']:,}[/]")
+    if known:
+        logger.print(f"[cyan]Известных рабочих комбинаций сохранено: {combo_stats['known_kept']:,} из {known:,} "
+                     f"({combo_stats['known_kept'] / known:.0%})[/]")
 
     total_generated = len(new_configs)
     logger.print(f"[yellow]Сгенерировано новых конфигов: {total_generated:,}[/]")
@@ -439,6 +507,7 @@ async def main():
     chunks = [new_configs[i:i + PROXIES_PER_BATCH] for i in range(0, len(new_configs), PROXIES_PER_BATCH)]
 
     live_results = []
+    store_writer = ResultsWriter("uidd")  # каждая проверка — в cache/probes.db
 
     with Progress(
         SpinnerColumn(),
@@ -451,67 +520,44 @@ async def main():
     ) as progress:
         task = progress.add_task("[cyan]Тестирование конфигов...", total=total_generated)
 
-        def test_batch(chunk, start_port):
-            cfg_path, mapping = create_batch_config_file(chunk, start_port, TEMP_DIR)
-            if not mapping:
-                for _ in chunk:
-                    progress.advance(task)
-                return []
-
-            proc = run_core(CORE_PATH, cfg_path)
-            if not proc:
-                for _ in chunk:
-                    progress.advance(task)
-                return []
-
-            started = False
-            for _ in range(int(CORE_STARTUP_TIMEOUT * 20)):
-                if is_port_in_use(mapping[0][1]):
-                    started = True
-                    break
-                time.sleep(0.05)
-
-            if not started:
-                kill_core(proc)
-                for _ in chunk:
-                    progress.advance(task)
-                return []
-
-            time.sleep(0.4)
-
-            batch_live = []
-            for url, port, parsed in mapping:
-                lat, err = check_connection(port)
-                addr = f"{parsed['address']}:{parsed['port']}"
-                tag = parsed['tag'][:50]
-
-                if lat:
-                    logger.print(f"[green]LIVE[/] {addr:<22} | {lat:>4} ms | {tag}")
-                    batch_live.append((url, lat))
-                else:
-                    #logger.print(f"[red]DEAD[/] {addr:<22} | {'':>8} | {tag} → {err or 'unknown error'}")
-                    pass
-                progress.advance(task)
-
-            kill_core(proc)
-            time.sleep(CORE_KILL_DELAY)
-
-            try:
-                os.remove(cfg_path)
-            except:
-                pass
-
-            return batch_live
-
-        with ThreadPoolExecutor(max_workers=TEST_THREADS) as executor:
-            futures = []
-            port_offset = LOCAL_PORT_START
-            for chunk in chunks:
-                futures.append(executor.submit(test_batch, chunk, port_offset))
-                port_offset += len(chunk) + 20
-
-            for future in as_completed(futures):
-                live_results.extend(future.result())
+        shards = shard_count(SHARDS, len(chunks))
+        summaries = []
+
+        def handle(message):
+            # Сообщения test_configs — одинаково из этого процесса и из шардов
+            kind = message[0]
+            if kind == "advance":
+                progress.advance(task, message[1])
+            elif kind == "probe":
+                _, url, latency, error = message
+                store_writer.add(url, latency, error)
+                if latency is not None:
+                    parsed = parse_vless(url)
+                    addr = f"{parsed['address']}:{parsed['port']}"
+                    logger.print(f"[green]LIVE[/] {addr:<22} | {latency:>4} ms | {parsed['tag'][:50]}")
+                    live_results.append((url, latency))
+            elif kind == "summary":
+                summaries.append(message[1])
+
+        if shards == 1:
+            test_configs(0, new_configs, (LOCAL_PORT_START, PORT_LAST), handle, CORE_PATH, TEMP_DIR, TEST_THREADS)
+        else:
+            # TEST_THREADS — общий бюджет xray, делится между шардами
+            threads = max(1, TEST_THREADS // shards)
+            logger.print(f"[cyan]Шардов: {shards}, xray в каждом: {threads}[/]")
+            for shard, message in run_sharded(test_configs, new_configs, shards,
+                                              args=(CORE_PATH, TEMP_DIR, threads), unit=PROXIES_PER_BATCH,
+                                              ports=(LOCAL_PORT_START, PORT_LAST)):
+                if message[0] == "summary":
+                    message = ("summary", [f"шард {shard}: {line}" for line in message[1]])
+                handle(message)
+
+    store_writer.close()
+    for lines in summaries:
+        for line in lines:
+            logger.print(f"[cyan]{line}[/]")
+    history.record_run(new_configs, [url for url, _ in live_results])
+    history.save()
 
     # 6. Дедупликация и сортировка
     logger.print("\n[yellow]Удаление дубликатов в стиле v2rayN (игнорируя host)...[/]")
@@ -0,0 +1,102 @@
+# =============================================================================
+# Таймауты, подстраивающиеся под задержки текущего запуска
+# =============================================================================
+# Живые прокси отвечают за сотни миллисекунд, а фиксированный таймаут в
+# 30-60 с держит поток (или целый xray с батчем) на каждом мёртвом. Здесь
+# таймаут считается по успешным проверкам этого же запуска:
+#     percentile(задержки) * FACTOR + MARGIN, в пределах [floor, cap]
+# и пересчитывается по мере прихода результатов. Пока успехов меньше
+# min_samples, действует cap — как раньше. По умолчанию процентиль — 100-й,
+# то есть самая медленная живая из виденных: медленный хвост живых редкий
+# (~1%), и любой процентиль ниже отрезает его целиком.
+# Каждая explore_every-я проверка идёт с cap. Процентиль считается только по
+# таким проверкам: успехи под урезанным таймаутом не видят медленного хвоста,
+# и таймаут по ним сползал бы вниз. По ним же видно, сколько живых не
+# уложилось бы в текущий таймаут (late), то есть цену экономии.
+# =============================================================================
+
+import threading
+from bisect import insort
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+# На синтетике (benchmarks.py adaptive_timeout, 15 093 живых из 50 000, 1% хвоста до 20 с):
+#   p99 x3   — 76% экономии, потеряно 89 живых (0.6%);
+#   p99.9 x3 — 20%, потеряно 3;  p99.9 x5 — 2%, не потеряно ни одного (таймаут = cap);
+#   p100 x1.25 — 56%, потеряно 4 (0.03%): все в первых ~1600 проверках, пока
+#   в выборке ещё нет ни одного из хвоста. Без потерь получается только cap.
+PERCENTILE    = 1.0
+FACTOR        = 1.25
+MARGIN        = 1.0      # с, запас сверху на медленные сети
+MIN_SAMPLES   = 30
+EXPLORE_EVERY = 10       # каждая такая проверка — с полным таймаутом
+
+
+class AdaptiveTimeout:
+    """Потокобезопасный таймаут в секундах: get() перед проверкой, observe()/timed_out() после."""
+
+    def __init__(self, name, cap, floor, percentile=PERCENTILE, factor=FACTOR, margin=MARGIN,
+                 min_samples=MIN_SAMPLES, explore_every=EXPLORE_EVERY):
+        self.name = name
+        self.cap = cap
+        self.floor = floor
+        self.percentile = percentile
+        self.factor = factor
+        self.margin = margin
+        self.min_samples = min_samples
+        self.explore_every = explore_every
+        self.samples = []         # задержки успехов под cap, с, по возрастанию
+        self.successes = 0
+        self.calls = 0
+        self.explored = 0         # успехов среди проверок с cap
+        self.late = 0             # из них не уложились бы в текущий таймаут
+        self.timeouts = 0
+        self.saved = 0.0          # сумма (limit - таймаут) по проверкам, упёршимся в таймаут
+        self.lock = threading.Lock()
+
+    def _value(self):
+        n = len(self.samples)
+        if n < self.min_samples:
+            return self.cap
+        p = self.samples[min(n - 1, int(self.percentile * n))]
+        return min(self.cap, max(self.floor, p * self.factor + self.margin))
+
+    def value(self):
+        """Текущий адаптивный таймаут без учёта explore."""
+        with self.lock:
+            return self._value()
+
+    def get(self):
+        """Таймаут для следующей проверки (или батча)."""
+        with self.lock:
+            self.calls += 1
+            if self.explore_every and self.calls % self.explore_every == 0:
+                return self.cap
+            return self._value()
+
+    def observe(self, seconds, used=None):
+        """Успешная проверка за seconds; used — с каким таймаутом она шла."""
+        with self.lock:
+            self.successes += 1
+            if used is None or used < self.cap:
+                return
+            if len(self.samples) >= self.min_samples:
+                self.explored += 1
+                if seconds > self._value():
+                    self.late += 1
+            insort(self.samples, seconds)
+
+    def timed_out(self, used, limit=None):
+        """Проверка упёрлась в таймаут used; limit — сколько ждали бы без адаптации (по умолчанию cap)."""
+        with self.lock:
+            self.timeouts += 1
+            self.saved += max(0.0, (limit or self.cap) - used)
+
+    def summary(self):
+        with self.lock:
+            line = (f"{self.name}: таймаут {self._value():.1f} с (потолок {self.cap:g} с, "
+                    f"успехов {self.successes}), упёрлись в таймаут {self.timeouts}, "
+                    f"сэкономлено ~{self.saved:.0f} с ожидания")
+            if self.explored:
+                line += (f"; проверок с полным таймаутом {self.explored}, "
+                         f"не уложились бы {self.late} ({self.late / self.explored:.1%})")
+            return line
@@ -0,0 +1,142 @@
+# =============================================================================
+# Инкрементальный индекс бэкапов old_work/
+# =============================================================================
+# Workflow после каждого запуска сдвигает old_worked1..N на единицу и кладёт
+# свежий sidr_vless_work.txt в old_worked1.txt, то есть между запусками
+# меняется ровно один файл. Индекс помнит, какие файлы уже прочитаны (по sha256
+# содержимого), и для каждого ключа дедупликации хранит номер запуска, где он
+# впервые и в последний раз встретился, плюс саму строку. Поэтому коллектор
+# читает только новые файлы, а не всю историю.
+# Если индекса нет или история с ним не сходится — он строится заново.
+# Формат файла: первая строка — JSON со служебными полями, дальше по строке на
+# ключ: «первый_запуск<TAB>последний_запуск<TAB>vless-строка». Сами ключи не
+# хранятся, а пересчитываются при загрузке — так файл вдвое меньше.
+# =============================================================================
+
+import glob
+import hashlib
+import json
+import os
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+BACKUP_DIR     = "old_work"
+INDEX_FILE     = os.path.join("cache", "backup_index.tsv")
+INDEX_VERSION  = 1
+MAX_SHIFT      = 48      # сколько новых файлов ищем, прежде чем строить индекс заново
+MATCH_DEPTH    = 3       # сколько файлов подряд должны совпасть с историей индекса
+RECENT_HASHES  = 8
+
+
+def backup_files(backup_dir=BACKUP_DIR):
+    """Файлы бэкапов от самого свежего (old_worked1) к самому старому."""
+    files = glob.glob(os.path.join(backup_dir, "old_worked*.txt"))
+    files.sort(key=lambda x: int(''.join(filter(str.isdigit, os.path.basename(x)))))
+    return files
+
+
+def file_sha(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_vless(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [l.strip() for l in f if l.strip().startswith("vless://")]
+
+
+class BackupIndex:
+    """key -> [первый запуск, последний запуск, строка]; run растёт на 1 с каждым файлом."""
+
+    def __init__(self, key_func, path=INDEX_FILE):
+        self.key_func = key_func
+        self.path = path
+        self.run = 0
+        self.recent = []     # sha прочитанных файлов, от нового к старому
+        self.entries = {}
+        self.loaded = False
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                meta = json.loads(f.readline())
+                if meta.get("version") == INDEX_VERSION:
+                    for row in f:
+                        first, last, line = row.rstrip("\n").split("\t", 2)
+                        self.entries[key_func(line)] = [int(first), int(last), line]
+                    self.run = meta["run"]
+                    self.recent = meta["recent"]
+                    self.loaded = True
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.entries = {}
+            print(f"Индекс бэкапов повреждён, строим заново: {e}")
+
+    # ---------------------------------------------------------------------
+    def _ingest(self, path, sha):
+        self.run += 1
+        for line in read_vless(path):
+            key = self.key_func(line)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = [self.run, self.run, line]
+            else:
+                entry[1] = self.run
+        self.recent = ([sha] + self.recent)[:RECENT_HASHES]
+
+    def _new_file_count(self, files, sha_of):
+        """Сколько самых свежих файлов ещё не в индексе; None — история не сходится."""
+        if not self.loaded or not self.recent:
+            return None
+        for shift in range(min(MAX_SHIFT, len(files)) + 1):
+            depth = min(MATCH_DEPTH, len(self.recent), len(files) - shift)
+            if depth <= 0:
+                break
+            if all(sha_of(files[shift + j]) == self.recent[j] for j in range(depth)):
+                return shift
+        return None
+
+    def update(self, backup_dir=BACKUP_DIR):
+        """Дочитывает новые бэкапы и выкидывает ключи, ушедшие из окна ротации.
+
+        Возвращает (число прочитанных файлов, перестроен ли индекс с нуля).
+        """
+        files = backup_files(backup_dir)
+        shas = {}
+
+        def sha_of(path):
+            if path not in shas:
+                shas[path] = file_sha(path)
+            return shas[path]
+
+        new_count = self._new_file_count(files, sha_of)
+        rebuilt = new_count is None
+        if rebuilt:
+            self.run, self.recent, self.entries = 0, [], {}
+            new_count = len(files)
+
+        # Читаем от старого к новому, чтобы номера запусков росли со временем
+        for path in reversed(files[:new_count]):
+            try:
+                self._ingest(path, sha_of(path))
+            except Exception as e:
+                print(f"Ошибка чтения локального файла {os.path.basename(path)}: {e}")
+
+        # Окно ротации: старейший существующий файл соответствует запуску run - len(files) + 1
+        oldest_run = self.run - len(files) + 1
+        self.entries = {k: e for k, e in self.entries.items() if e[1] >= oldest_run}
+        return new_count, rebuilt
+
+    def lines(self):
+        """Строки всех ключей окна, от недавно виденных к давно виденным."""
+        return [e[2] for e in sorted(self.entries.values(), key=lambda e: -e[1])]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"version": INDEX_VERSION, "run": self.run, "recent": self.recent}) + "\n")
+            for first, last, line in self.entries.values():
+                f.write(f"{first}\t{last}\t{line}\n")
+        os.replace(tmp, self.path)
@@ -0,0 +1,255 @@
+# =============================================================================
+# Компактная проверка «IPv4 входит в разрешённые CIDR»
+# =============================================================================
+# Раньше коллектор разворачивал каждый CIDR через network.hosts() в множество
+# строк — миллионы объектов str и сотни МБ памяти ещё до первой загрузки.
+# Здесь диапазоны сливаются в отсортированные непересекающиеся отрезки
+# [start, end], которые хранятся в двух массивах uint32, а проверка адреса —
+# это один bisect.
+# Пачку адресов match_many проверяет одним numpy.searchsorted по тем же
+# массивам; без numpy — тот же результат через bisect по одному адресу.
+# numpy импортируется при первой пачке, а не при старте (~0.2 с).
+#
+# Слитые отрезки хранятся готовой таблицей (CidrMatcher.cached):
+#   8 байт MAGIC | 16 байт blake2b списка CIDR | uint32 n | n начал | n концов
+# (числа little-endian). Хэш не совпал со списком — таблица собирается заново
+# и перезаписывается. Таблица — единицы КБ, поэтому читается целиком, без mmap.
+#
+# Запуск:  python cidr_match.py build [файл]   — собрать таблицу из файла
+#          (один CIDR на строку) или из CIDR_STRINGS коллектора
+# =============================================================================
+
+import bisect
+import hashlib
+import ipaddress
+import os
+import socket
+import struct
+import sys
+from array import array
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+CIDR_TABLE_FILE = os.path.join("cache", "cidr_ranges.bin")
+TABLE_MAGIC     = b"CIDRTBL1"
+TABLE_HEADER    = struct.Struct("<8s16sI")
+
+_numpy = None
+
+
+def numpy_module():
+    """numpy или None, если не установлен; импорт — при первом вызове."""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+def cidr_digest(cidr_strings):
+    """Хэш списка CIDR в том порядке и виде, как он задан."""
+    return hashlib.blake2b("\n".join(cidr_strings).encode(), digest_size=16).digest()
+
+
+def host_range(network):
+    """Отрезок (first, last) адресов, которые выдаёт network.hosts()."""
+    first = int(network.network_address)
+    last = int(network.broadcast_address)
+    # hosts() не включает адрес сети и broadcast, кроме /31 и /32
+    if network.prefixlen < network.max_prefixlen - 1:
+        first += 1
+        last -= 1
+    return first, last
+
+
+def pack_ipv4(ips):
+    """Адреса (строка, int или None) -> (4 байта big-endian на адрес, bytes/bytearray 0/1 валидности).
+
+    Невалидные и не-IPv4 адреса пакуются нулями и помечаются 0.
+    """
+    pton, af, zero = socket.inet_pton, socket.AF_INET, bytes(4)
+    if not isinstance(ips, list):
+        ips = list(ips)
+    # обычная пачка коллектора — строки IPv4 и None: одним join, без ветвлений на адрес
+    try:
+        packed = b"".join([zero if ip is None else pton(af, ip) for ip in ips])
+        return packed, bytes([ip is not None for ip in ips])
+    except (OSError, TypeError, ValueError):
+        pass
+    packed, valid = bytearray(), bytearray()
+    for ip in ips:
+        try:
+            if isinstance(ip, int):
+                raw = ip.to_bytes(4, "big")
+            else:
+                raw = pton(af, ip)
+        except (OSError, OverflowError, TypeError, ValueError):
+            raw = None
+        packed += raw or zero
+        valid.append(raw is not None)
+    return packed, valid
+
+
+def merge_ranges(ranges):
+    """Сливает пересекающиеся и соседние отрезки, возвращает отсортированный список."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class CidrMatcher:
+    """Множество IPv4-адресов из списка CIDR в виде слитых отрезков."""
+
+    __slots__ = ("starts", "ends", "_np")
+
+    def __init__(self, cidr_strings=()):
+        ranges = []
+        for cidr in cidr_strings:
+            try:
+                network = ipaddress.ip_network(cidr, strict=False)
+            except Exception as e:
+                print(f"Ошибка при обработке CIDR {cidr}: {e}")
+                continue
+            if network.version != 4:
+                continue
+            ranges.append(host_range(network))
+
+        merged = merge_ranges(ranges)
+        self.starts = array('I', (s for s, _ in merged))
+        self.ends = array('I', (e for _, e in merged))
+        self._np = None
+
+    @classmethod
+    def from_arrays(cls, starts, ends):
+        matcher = cls.__new__(cls)
+        matcher.starts, matcher.ends, matcher._np = starts, ends, None
+        return matcher
+
+    @classmethod
+    def cached(cls, cidr_strings, path=CIDR_TABLE_FILE):
+        """Матчер из готовой таблицы path; нет её или список изменился — собирает и сохраняет.
+
+        Возвращает (матчер, True если таблица собрана заново).
+        """
+        cidr_strings = list(cidr_strings)
+        digest = cidr_digest(cidr_strings)
+        matcher = cls.load(path, digest)
+        if matcher is not None:
+            return matcher, False
+        matcher = cls(cidr_strings)
+        try:
+            matcher.save(path, digest)
+        except OSError as e:
+            print(f"Не удалось сохранить таблицу CIDR: {e}")
+        return matcher, True
+
+    @classmethod
+    def load(cls, path, digest=None):
+        """Матчер из таблицы или None (нет файла, чужой формат, другой хэш)."""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < TABLE_HEADER.size:
+            return None
+        magic, file_digest, count = TABLE_HEADER.unpack_from(data)
+        if magic != TABLE_MAGIC or (digest is not None and file_digest != digest):
+            return None
+        if len(data) != TABLE_HEADER.size + 8 * count:
+            return None
+        starts, ends = array('I'), array('I')
+        body = memoryview(data)[TABLE_HEADER.size:]
+        starts.frombytes(body[:4 * count])
+        ends.frombytes(body[4 * count:])
+        if sys.byteorder == "big":
+            starts.byteswap()
+            ends.byteswap()
+        return cls.from_arrays(starts, ends)
+
+    def save(self, path, digest):
+        starts, ends = array('I', self.starts), array('I', self.ends)
+        if sys.byteorder == "big":
+            starts.byteswap()
+            ends.byteswap()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(TABLE_HEADER.pack(TABLE_MAGIC, digest, len(starts)))
+            f.write(starts.tobytes())
+            f.write(ends.tobytes())
+        os.replace(tmp, path)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def address_count(self):
+        """Сколько адресов покрывают диапазоны (аналог len(allowed_ips_set))."""
+        return sum(e - s + 1 for s, e in zip(self.starts, self.ends))
+
+    def contains_int(self, value):
+        i = bisect.bisect_right(self.starts, value) - 1
+        return i >= 0 and value <= self.ends[i]
+
+    def __contains__(self, ip):
+        if isinstance(ip, int):
+            return self.contains_int(ip)
+        try:
+            return self.contains_int(int(ipaddress.IPv4Address(ip)))
+        except ValueError:
+            return False
+
+    def match_many(self, ips, use_numpy=None):
+        """Маска «адрес в диапазонах» для пачки адресов (строки, int или None), list[bool].
+
+        use_numpy=None — numpy, если установлен.
+        """
+        packed, valid = pack_ipv4(ips)
+        if not self.starts:
+            return [False] * len(valid)
+        np = numpy_module() if use_numpy is not False else None
+        if use_numpy and np is None:
+            raise RuntimeError("numpy не установлен")
+        if np is None:
+            values = array('I')
+            values.frombytes(packed)
+            if sys.byteorder == "little":
+                values.byteswap()
+            contains = self.contains_int
+            return [bool(ok) and contains(v) for v, ok in zip(values, valid)]
+
+        if self._np is None:
+            self._np = (np.frombuffer(self.starts, dtype=np.uint32),
+                        np.frombuffer(self.ends, dtype=np.uint32))
+        starts, ends = self._np
+        values = np.frombuffer(packed, dtype=">u4").astype(np.uint32)
+        i = np.searchsorted(starts, values, side="right") - 1
+        hit = (i >= 0) & (values <= ends[np.maximum(i, 0)])
+        hit &= np.frombuffer(valid, dtype=np.bool_)
+        return hit.tolist()
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] != "build":
+        print("Команды: build [файл с CIDR]")
+        return 1
+    if len(argv) > 2:
+        with open(argv[2], "r", encoding="utf-8") as f:
+            cidrs = [l.strip() for l in f if l.strip() and not l.startswith("#")]
+    else:
+        from collect_russian_vless import CIDR_STRINGS as cidrs
+    matcher = CidrMatcher(cidrs)
+    matcher.save(CIDR_TABLE_FILE, cidr_digest(cidrs))
+    print(f"{CIDR_TABLE_FILE}: {len(cidrs)} CIDR -> {len(matcher)} диапазонов")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
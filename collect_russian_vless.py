@@ -1,10 +1,18 @@
 import re
-import socket
+import os
+import glob
+import hashlib
 import ipaddress
-import requests
+import itertools
 from tqdm import tqdm
-from collections import OrderedDict
-import concurrent.futures  # Добавлено для многопоточности
+
+from backup_index import BackupIndex, backup_files
+from history_store import KEEP_RUNS, HistoryStore
+from cidr_match import CidrMatcher
+from dns_resolve import BatchResolver, DnsCache
+from results_store import ResultsStore
+from source_fetch import SourceCache, group_mirrors, iter_fetch, print_fetch_report, source_lines, source_mirrors
+from vless_parse import extract_host_from_vless, get_dedup_key
 
 CIDR_STRINGS = [
 
@@ -1756,19 +1764,20 @@ CIDR_STRINGS = [
 ]
 
 
-print("Генерируем множество всех разрешённых IP из CIDR-диапазонов...")
-allowed_ips_set = set()
-for cidr in CIDR_STRINGS:
-    try:
-        network = ipaddress.ip_network(cidr, strict=False)
-        for ip in network.hosts():
-            allowed_ips_set.add(str(ip))
-    except Exception as e:
-        print(f"Ошибка при обработке CIDR {cidr}: {e}")
-print(f"Генерация завершена: {len(allowed_ips_set):,} уникальных IPv4-адресов в разрешённых диапазонах.\n")
-
 # URL источников
 MAIN_URL = 'https://raw.githubusercontent.com/Epodonios/v2ray-configs/refs/heads/main/All_Configs_Sub.txt'
+# Наборы зеркал одних и тех же файлов: имя набора -> префиксы URL, за которыми
+# один и тот же путь. Файл из набора качается одной группой со всех зеркал
+# (и с translate.yandex-прокси этих адресов), первое полное тело побеждает
+# (см. source_fetch.group_mirrors). Сюда — только то, про что известно, что
+# отдаёт тот же файл: отличающееся содержимое остальных зеркал молча пропало бы.
+MIRROR_SETS = {
+    "etoneyaproject": (
+        "https://raw.githubusercontent.com/EtoNeYaProject/etoneyaproject.github.io/refs/heads/main/",
+        "https://cdn.jsdelivr.net/gh/EtoNeYaProject/EtoNeYaProject.github.io@refs/heads/main/",
+        "https://etoneya.a9fm.site/",
+    ),
+}
 ADDITIONAL_URLS = [
     "https://gitverse.ru/api/repos/Vsevj/OBS/raw/branch/master/wwh"
    "https://storage.yandexcloud.net/nllrcn-proxy-subs/subs/prem-links.txt"
@@ -2414,10 +2423,6 @@ ADDITIONAL_URLS = [
 ]
 
 
-def extract_host_from_vless(vless_url):
-    match = re.search(r'@([^:]+):', vless_url)
-    return match.group(1).strip() if match else None
-
 def is_ip_address(string):
     try:
         ipaddress.ip_address(string)
@@ -2425,88 +2430,129 @@ def is_ip_address(string):
     except ValueError:
         return False
 
-def resolve_to_ipv4(host):
-    try:
-        return socket.gethostbyname(host)
-    except Exception:
-        return None
-
 def modify_config(line, new_ip):
     modified = re.sub(r'@[^:]+:', f'@{new_ip}:', line)
     modified = re.sub(r'fp=[^&]+&', 'fp=firefox&', modified)
     return modified
 
-# Сбор конфигов (остаётся последовательным)
-all_vless_lines = []
-print("Скачиваем основной источник...")
-try:
-    resp = requests.get(MAIN_URL, timeout=20)
-    resp.raise_for_status()
-    vless = [l.strip() for l in resp.text.splitlines() if l.strip().startswith('vless://')]
-    all_vless_lines.extend(vless)
-    print(f"Основной источник: {len(vless)} конфигов")
-except Exception as e:
-    print(f"Ошибка основного источника: {e}")
+# =============================================================================
+# Потоковый конвейер: источники → фильтр vless → дедупликация → резолв →
+# проверка CIDR → запись. Ни одна стадия не держит весь набор строк целиком:
+# в памяти только множество уже встреченных ключей и одна пачка на резолв.
+# =============================================================================
+SIDR_OUTPUT = 'sidr_vless.txt'
+RESOLVE_BATCH = 5000   # сколько строк копим, чтобы резолвить их имена одним заходом
+MATCH_BATCH   = 5000   # сколько адресов проверяем по CIDR одним вызовом (CidrMatcher.match_many)
+DEDUP_DIGEST = True    # хранить ключи дедупликации как 16-байтные blake2b вместо строк
+DEDUP_CHECK_COLLISIONS = False  # отладка: помнить исходные ключи и падать на коллизии дайджестов
+# Бэкап-строки, не прошедшие столько проверок work_test подряд, пропускаем; None — не пропускаем
+# (по умолчанию): бэкапы — запас на случай, когда источники пусты, и терять его нельзя
+HISTORY_DEAD_FAILS = None
+
+
+def iter_remote_lines():
+    """Сбор конфигов: все источники качаются параллельно (см. source_fetch.py),
+    неизменившиеся между запусками берутся из кэша по ETag / Last-Modified / хэшу,
+    у групп зеркал побеждает первое полное тело. Строки источника уходят дальше по
+    конвейеру, как только он скачан, не дожидаясь остальных."""
+    print("Скачиваем основной и дополнительные источники параллельно...")
+    fetch_results = []
+    urls = [MAIN_URL] + ADDITIONAL_URLS
+    sources = group_mirrors(urls, MIRROR_SETS)
+    # Номер источника в логах — по списку URL, как без групп: группа — номером первого зеркала
+    numbers = {}
+    for n, url in enumerate(urls):
+        numbers.setdefault(url, n)
+    for n, res in iter_fetch(sources, cache=SourceCache()):
+        i = numbers[source_mirrors(sources[n])[0]]
+        if res["error"]:
+            print(f"Ошибка основного источника: {res['error']}" if i == 0 else f"Ошибка источника {i}: {res['error']}")
+        elif i == 0:
+            print(f"Основной источник: {res['count']} конфигов")
+        elif res["count"]:
+            print(f"Источник {i}: {res['count']} конфигов")
+        yield from source_lines(res)
+        res["lines"] = None  # отдали — и забыли, для отчёта хватит счётчиков
+        fetch_results.append(res)
+    print_fetch_report(fetch_results)
+
 
-print("Скачиваем дополнительные источники...")
-for i, url in enumerate(ADDITIONAL_URLS, 1):
+def backup_index_lines():
+    """Бэкапы old_work/ читаются через инкрементальный индекс (см. backup_index.py):
+    между запусками добавляется один файл, его и дочитываем."""
+    print("\nОбновляем индекс локальных бэкапов...")
+    backup_index = BackupIndex(index_key)
+    new_files, rebuilt = backup_index.update()
+    if rebuilt:
+        print(f"Индекс построен заново: прочитано {new_files} бэкап-файлов")
+    else:
+        print(f"Дочитано новых бэкап-файлов: {new_files}")
     try:
-        resp = requests.get(url, timeout=15)
-        resp.raise_for_status()
-        vless = [l.strip() for l in resp.text.splitlines() if l.strip().startswith('vless://')]
-        all_vless_lines.extend(vless)
-        if len(vless) > 0:
-            print(f"Источник {i}: {len(vless)} конфигов")
+        backup_index.save()
     except Exception as e:
-        print(f"Ошибка источника {i}: {e}")
+        print(f"Не удалось сохранить индекс бэкапов: {e}")
+    print(f"Локальные бэкапы: {len(backup_index.entries)} уникальных конфигов за {len(backup_files())} запусков")
+    return backup_index.lines()
 
-import os
-import glob
 
-BACKUP_DIR = "old_work"
-local_files = glob.glob(os.path.join(BACKUP_DIR, "old_worked*.txt"))
+def iter_backup_lines():
+    """Прошлые рабочие конфиги: история запусков (history_store.py) за окно KEEP_RUNS;
+    пока её нет — старые бэкапы old_work/."""
+    history = HistoryStore()
+    if len(history):
+        rows = history.window(KEEP_RUNS)
+        print(f"\nИстория запусков: {len(rows)} конфигов за {min(len(history), KEEP_RUNS)} запусков")
+        lines = [url for url, _, _ in rows]
+    else:
+        lines = backup_index_lines()
 
-# Сортируем от самого свежего (old_worked1) к старому
-local_files.sort(key=lambda x: int(''.join(filter(str.isdigit, os.path.basename(x)))))
+    # Что давно и подряд не проходит проверку, по хранилищу результатов work_test (results_store.py)
+    dead = set()
+    if HISTORY_DEAD_FAILS is not None:
+        store = ResultsStore()
+        if store.available:
+            dead = store.dead_keys(HISTORY_DEAD_FAILS)
+            store.close()
+        print(f"Пропускаем бэкап-конфиги, не прошедшие {HISTORY_DEAD_FAILS} проверок подряд: {len(dead)}")
+    print()
+    for line in lines:
+        if not dead or get_dedup_key(line) not in dead:
+            yield line
 
-print(f"\nНайдено локальных бэкап-файлов: {len(local_files)} шт.")
-print("Читаем локальные бэкапы...")
 
-for i, file_path in enumerate(local_files, 1):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            vless = [l.strip() for l in content.splitlines() if l.strip().startswith('vless://')]
-            all_vless_lines.extend(vless)
-            if len(vless) > 0:
-                print(f"Локальный бэкап {i} ({os.path.basename(file_path)}): {len(vless)} конфигов")
-    except Exception as e:
-        print(f"Ошибка чтения локального файла {i} ({os.path.basename(file_path)}): {e}")
+def find_root_vless_files():
+    """Дополнительные файлы из корня репозитория (только с цифрами: vless*.txt где есть цифры)."""
+    return [
+        f for f in glob.glob("vless*.txt")
+        if re.search(r'\d', os.path.basename(f))  # проверяем, есть ли хотя бы одна цифра в имени файла
+    ]
 
-# === 3. Читаем дополнительные файлы из корня репозитория (только с цифрами: vless*.txt где есть цифры) ===
-print("\nПроверяем дополнительные файлы в корне репозитория (vless с цифрами)...")
 
-# Находим файлы вида vless*.txt, где в имени есть хотя бы одна цифра
-import re
-root_vless_files = [
-    f for f in glob.glob("vless*.txt")
-    if re.search(r'\d', os.path.basename(f))  # проверяем, есть ли хотя бы одна цифра в имени файла
-]
-
-if root_vless_files:
+def iter_root_lines(root_vless_files):
+    print("\nПроверяем дополнительные файлы в корне репозитория (vless с цифрами)...")
+    if not root_vless_files:
+        print("Дополнительных файлов вида vless<цифры>.txt в корне не найдено.")
+        return
     print(f"Найдено файлов с цифрами в имени: {len(root_vless_files)} шт.")
     for i, file_path in enumerate(root_vless_files, 1):
+        count = 0
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                vless = [l.strip() for l in content.splitlines() if l.strip().startswith('vless://')]
-                all_vless_lines.extend(vless)
-                if len(vless) > 0:
-                    print(f"Корневой файл {i} ({os.path.basename(file_path)}): {len(vless)} конфигов")
+                for l in f:
+                    l = l.strip()
+                    if l.startswith('vless://'):
+                        count += 1
+                        yield l
         except Exception as e:
             print(f"Ошибка чтения {os.path.basename(file_path)}: {e}")
+        if count > 0:
+            print(f"Корневой файл {i} ({os.path.basename(file_path)}): {count} конфигов")
 
-    # Удаляем все эти файлы после успешного чтения
+
+def remove_root_files(root_vless_files):
+    # Удаляем все эти файлы после успешной обработки
+    if not root_vless_files:
+        return
     print("Удаляем обработанные корневые файлы...")
     for file_path in root_vless_files:
         try:
@@ -2514,88 +2560,147 @@ if root_vless_files:
             print(f"Удалён: {os.path.basename(file_path)}")
         except Exception as e:
             print(f"Не удалось удалить {os.path.basename(file_path)}: {e}")
-else:
-    print("Дополнительных файлов вида vless<цифры>.txt в корне не найдено.")
 
 
-print(f"\nВсего собрано vless-ссылок: {len(all_vless_lines)}")
+def dedup_digest(key):
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
 
-# === Умная дедупликация: один сервер = одна строка, независимо от названия и fp ===
-def get_dedup_key(vless_url):
-    """Возвращает ключ для дедупликации: всё кроме #комментария и параметра fp"""
-    # Убираем фрагмент после #
-    url_no_fragment = re.sub(r'#.*$', '', vless_url).strip()
-    
-    # Если нет параметров — возвращаем как есть
-    if '?' not in url_no_fragment:
-        return url_no_fragment
-    
-    base = url_no_fragment.split('?')[0]
-    params_str = url_no_fragment.split('?', 1)[1]
-    
-    # Разбиваем параметры, убираем fp=... и remark=...
-    params = params_str.split('&')
-    filtered = []
-    for p in params:
-        if p.startswith('fp=') or p.startswith('remark='):
+def index_key(line):
+    """Ключ строки для множеств и индекса бэкапов: дайджест или сам ключ."""
+    key = get_dedup_key(line)
+    return dedup_digest(key) if DEDUP_DIGEST else key
+
+
+class DedupKeySet:
+    """Множество уже встреченных ключей дедупликации.
+
+    С digest=True хранит 16-байтные blake2b вместо полных URL — в разы меньше
+    памяти на сотнях тысяч ключей. check=True дополнительно помнит исходный
+    ключ для каждого дайджеста и бросает ошибку, если два разных ключа совпали.
+    """
+
+    def __init__(self, digest=DEDUP_DIGEST, check=DEDUP_CHECK_COLLISIONS):
+        self.digest = digest
+        self.origins = {} if check and digest else None
+        self._seen = set()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def add(self, key):
+        """Добавляет ключ; True — если его ещё не было."""
+        item = dedup_digest(key) if self.digest else key
+        if item in self._seen:
+            if self.origins is not None and self.origins[item] != key:
+                raise RuntimeError(f"Коллизия дайджеста: {self.origins[item]!r} и {key!r}")
+            return False
+        self._seen.add(item)
+        if self.origins is not None:
+            self.origins[item] = key
+        return True
+
+
+def dedup_lines(lines, stats, seen=None):
+    """Умная дедупликация на лету: один сервер — одна строка (первая встреченная)."""
+    seen = seen if seen is not None else DedupKeySet()
+    for line in lines:
+        stats["total"] += 1
+        if not seen.add(get_dedup_key(line)):
             continue
-        if p:  # пропускаем пустые
-            filtered.append(p)
-    
-    # Сортируем, чтобы порядок параметров не влиял
-    filtered.sort()
-    
-    if filtered:
-        return f"{base}?{'&'.join(filtered)}"
-    else:
-        return base
+        stats["unique"] += 1
+        yield line
 
-print("Выполняем умную дедупликацию (один сервер — одна строка, без учёта названий и fp)...")
-unique_lines = list(OrderedDict((get_dedup_key(line), line) for line in all_vless_lines).values())
 
-print(f"После удаления дубликатов по серверу: {len(unique_lines)} уникальных\n")
-# =====================================================================
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-# Функция обработки одной строки (возвращает модифицированный конфиг или None)
-def process_line(line):
-    if not line.startswith('vless://'):
-        return None
-    host_or_ip = extract_host_from_vless(line)
-    if not host_or_ip:
-        return None
-    target_ip = None
-    if is_ip_address(host_or_ip):
-        ip_obj = ipaddress.ip_address(host_or_ip)
-        if ip_obj.version == 4:
-            target_ip = host_or_ip
-    else:
-        
-        resolved = resolve_to_ipv4(host_or_ip)
 
-        if resolved:
-            target_ip = resolved
-    if target_ip and target_ip in allowed_ips_set:
-        return modify_config(line, target_ip)
-    return None
+def resolve_lines(lines, dns_cache, stats, batch_size=RESOLVE_BATCH):
+    """Резолв пачками: каждое уникальное имя — один раз, с кэшем между запусками
+    (см. dns_resolve.py); event loop и резолвер — одни на все пачки.
+    Отдаёт пары (строка, IPv4 или None)."""
+    with BatchResolver(dns_cache) as resolver:
+        stats["resolver"] = resolver.kind
+        for batch in batched(lines, batch_size):
+            hosts = [extract_host_from_vless(line) for line in batch]
+            names = {h for h in hosts if h and not is_ip_address(h)}
+            resolved = {}
+            if names:
+                resolved, dns_stats = resolver.resolve(names)
+                for k in ("cached", "resolved", "nxdomain", "failed"):
+                    stats[k] += dns_stats[k]
+            for line, host_or_ip in zip(batch, hosts):
+                target_ip = None
+                if host_or_ip and is_ip_address(host_or_ip):
+                    if ipaddress.ip_address(host_or_ip).version == 4:
+                        target_ip = host_or_ip
+                elif host_or_ip:
+                    target_ip = resolved.get(host_or_ip)
+                yield line, target_ip
+
+
+def match_lines(pairs, allowed_ips, batch_size=MATCH_BATCH):
+    """Оставляет конфиги с разрешённым IP и подставляет IP вместо имени хоста.
+    Адреса пачки проверяются одним вызовом match_many (numpy, если установлен)."""
+    for batch in batched(pairs, batch_size):
+        mask = allowed_ips.match_many([target_ip for _, target_ip in batch])
+        for (line, target_ip), allowed in zip(batch, mask):
+            if allowed:
+                yield modify_config(line, target_ip)
+
+
+def write_lines(configs, path):
+    """Пишет результат по мере поступления; файл заменяется только в конце."""
+    count = 0
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        for cfg in configs:
+            f.write(cfg + '\n')
+            count += 1
+    os.replace(tmp, path)
+    return count
+
+
+def main():
+    print("Собираем разрешённые диапазоны IP из CIDR...")
+    # Слитые отрезки + bisect вместо множества из миллионов строк (см. cidr_match.py);
+    # готовая таблица в cache/, пересобирается, когда меняется CIDR_STRINGS
+    allowed_ips, rebuilt = CidrMatcher.cached(CIDR_STRINGS)
+    if rebuilt:
+        print("Список CIDR изменился — таблица диапазонов собрана заново")
+    print(f"Готово: {len(allowed_ips):,} диапазонов, {allowed_ips.address_count():,} уникальных IPv4-адресов в разрешённых диапазонах.\n")
+
+    root_vless_files = find_root_vless_files()
+    dedup_stats = {"total": 0, "unique": 0}
+    dns_stats = {"cached": 0, "resolved": 0, "nxdomain": 0, "failed": 0}
+    dns_cache = DnsCache()
+
+    lines = itertools.chain(iter_remote_lines(), iter_backup_lines(), iter_root_lines(root_vless_files))
+    unique = dedup_lines(lines, dedup_stats)
+    pairs = resolve_lines(unique, dns_cache, dns_stats)
+    matched = match_lines(tqdm(pairs, desc="Проверка конфигов", unit="шт"), allowed_ips)
+    saved = write_lines(matched, SIDR_OUTPUT)
+
+    try:
+        dns_cache.save()
+    except Exception as e:
+        print(f"Не удалось сохранить DNS-кэш: {e}")
+    remove_root_files(root_vless_files)
 
-# Многопоточная обработка в 200 потоков
-matched_configs = []
-print("Обработка конфигов в 200 потоках...")
-with concurrent.futures.ThreadPoolExecutor(max_workers=200) as executor:
-    futures = [executor.submit(process_line, line) for line in unique_lines]
-    
-    with tqdm(total=len(unique_lines), desc="Проверка конфигов", unit="шт") as pbar:
-        for future in concurrent.futures.as_completed(futures):
-            result = future.result()
-            if result:
-                matched_configs.append(result)
-            pbar.update(1)
-            pbar.set_postfix({"найдено": len(matched_configs)})
+    print(f"\nВсего собрано vless-ссылок: {dedup_stats['total']}")
+    print(f"После удаления дубликатов по серверу: {dedup_stats['unique']} уникальных")
+    print(f"DNS ({dns_stats.get('resolver', 'не понадобился')}): из кэша {dns_stats['cached']}, "
+          f"отрезолвлено {dns_stats['resolved']}, NXDOMAIN {dns_stats['nxdomain']}, ошибок {dns_stats['failed']}")
+    print(f"\nГотово! Найдено и сохранено {saved} конфигов с разрешёнными IP в файл '{SIDR_OUTPUT}'")
 
-# Сохранение результата
-sidr_output = 'sidr_vless.txt'
-with open(sidr_output, 'w', encoding='utf-8') as f:
-    for cfg in matched_configs:
-        f.write(cfg + '\n')
 
-print(f"\nГотово! Найдено и сохранено {len(matched_configs)} конфигов с разрешёнными IP в файл '{sidr_output}'")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# =============================================================================
+# Предотбор комбинаций UUID × хвост для Uidd_gen_work по истории запусков
+# =============================================================================
+# Uidd_gen_work пробует каждый UUID на каждом живом сервере — квадрат от входа,
+# и всё это идёт через xray. Здесь комбинации ранжируются по тому, что уже
+# известно, и на каждый хвост остаётся не больше TOP_K_PER_TAIL лучших:
+#   1. UUID уже работал на этом сервере (адрес, pbk, sni) — известная пара;
+#   2. UUID работал на сервере с тем же pbk (та же панель) или тем же адресом;
+#   3. на скольких серверах UUID вообще работал.
+# Сервер, который несколько запусков подряд отверг все UUID и ни разу ничего
+# не принял, отбрасывается целиком.
+# История — рабочие конфиги последних запусков (history_store.py, пока её нет —
+# бэкапы old_work/) и sidr_vless_work.txt
+# плюс собственная статистика Uidd_gen_work (что тестировали и что ожило),
+# которая хранится в cache/ между запусками.
+# =============================================================================
+
+import json
+import os
+from collections import defaultdict
+
+from backup_index import backup_files, read_vless
+from history_store import HistoryStore
+from vless_parse import parse as parse_record
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+HISTORY_FILE     = os.path.join("cache", "uidd_history.json")
+HISTORY_VERSION  = 1
+HISTORY_BACKUPS  = 48        # сколько последних запусков читать как историю
+WORK_FILES       = ["sidr_vless_work.txt"]
+TOP_K_PER_TAIL   = 100       # сколько UUID пробовать на один хвост; None — без ограничения
+REJECT_RUNS      = 3         # после стольких запусков «никто не подошёл» сервер отбрасывается
+
+
+def server_key(rec):
+    """Сервер с точки зрения UUID: адрес, ключ REALITY и SNI."""
+    return (rec.address, rec.param("pbk"), rec.param("sni") or rec.address)
+
+
+class ComboHistory:
+    """Какие UUID где работали и как серверы принимали чужие UUID.
+
+    worked: server_key -> множество UUID, которые на нём работали;
+    tested/accepted: server_key -> сколько сгенерированных комбинаций проверено/ожило;
+    empty_runs: server_key -> запусков подряд, в которых не ожила ни одна.
+    """
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self.worked = defaultdict(set)
+        self.tested = defaultdict(int)
+        self.accepted = defaultdict(int)
+        self.empty_runs = defaultdict(int)
+        if not path:
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == HISTORY_VERSION:
+                for row in data["servers"]:
+                    key = tuple(row["key"])
+                    if row["worked"]:
+                        self.worked[key] = set(row["worked"])
+                    self.tested[key] = row["tested"]
+                    self.accepted[key] = row["accepted"]
+                    self.empty_runs[key] = row["empty_runs"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"История Uidd повреждена, начинаем заново: {e}")
+
+    def __bool__(self):
+        return bool(self.worked or self.tested)
+
+    def add_working(self, urls):
+        """Учитывает заведомо рабочие конфиги (бэкапы, sidr_vless_work.txt)."""
+        for url in urls:
+            rec = parse_record(url)
+            if rec and rec.uuid:
+                self.worked[server_key(rec)].add(rec.uuid.lower())
+
+    def load_backups(self, backups=HISTORY_BACKUPS, work_files=WORK_FILES):
+        store = HistoryStore()
+        if len(store):
+            for urls in store.recent(backups):
+                self.add_working(urls)
+            paths = []
+        else:
+            paths = backup_files()[:backups]
+        for path in paths + [p for p in work_files if os.path.exists(p)]:
+            try:
+                self.add_working(read_vless(path))
+            except Exception as e:
+                print(f"Ошибка чтения истории {os.path.basename(path)}: {e}")
+
+    def record_run(self, tested_urls, live_urls):
+        """Итоги запуска Uidd_gen_work: что проверяли и что ожило."""
+        tested = defaultdict(int)
+        for url in tested_urls:
+            rec = parse_record(url)
+            if rec:
+                tested[server_key(rec)] += 1
+        live = defaultdict(int)
+        for url in live_urls:
+            rec = parse_record(url)
+            if rec:
+                live[server_key(rec)] += 1
+        for key, n in tested.items():
+            self.tested[key] += n
+            self.accepted[key] += live[key]
+            self.empty_runs[key] = 0 if live[key] else self.empty_runs[key] + 1
+        self.add_working(live_urls)
+
+    def rejects_all(self, key):
+        return self.empty_runs[key] >= REJECT_RUNS and not self.accepted[key] and not self.worked.get(key)
+
+    def save(self):
+        if not self.path:
+            return
+        keys = set(self.worked) | set(self.tested)
+        servers = [{"key": list(k), "worked": sorted(self.worked.get(k, ())), "tested": self.tested.get(k, 0),
+                    "accepted": self.accepted.get(k, 0), "empty_runs": self.empty_runs.get(k, 0)}
+                   for k in sorted(keys)]
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": HISTORY_VERSION, "servers": servers}, f)
+        os.replace(tmp, self.path)
+
+
+def select_combinations(originals, uuids, history, top_k=TOP_K_PER_TAIL):
+    """Комбинации UUID × хвост в порядке ранга, не больше top_k на хвост.
+
+    originals — пары (исходный uuid, хвост после @). Возвращает (список vless-строк,
+    статистика). Без истории ранжировать не по чему — отдаются все комбинации.
+    """
+    stats = {"generated": 0, "kept": 0, "known": 0, "known_kept": 0, "servers_dropped": 0}
+    by_pbk, by_address, popularity = defaultdict(set), defaultdict(set), defaultdict(int)
+    for (address, pbk, _), worked in history.worked.items():
+        if pbk:
+            by_pbk[pbk] |= worked
+        by_address[address] |= worked
+        for uuid in worked:
+            popularity[uuid] += 1
+
+    configs = []
+    for orig_uuid, tail in originals:
+        rec = parse_record(f"vless://{orig_uuid}@{tail}")
+        candidates = [u for u in uuids if u != orig_uuid]
+        stats["generated"] += len(candidates)
+        if rec is None or not history:
+            configs.extend(f"vless://{u}@{tail}" for u in candidates)
+            stats["kept"] += len(candidates)
+            continue
+
+        key = server_key(rec)
+        worked = history.worked.get(key, ())
+        known = sum(1 for u in candidates if u in worked)
+        stats["known"] += known
+        if history.rejects_all(key):
+            stats["servers_dropped"] += 1
+            continue
+
+        same_pbk = by_pbk.get(key[1], ()) if key[1] else ()
+        same_address = by_address.get(key[0], ())
+        candidates.sort(key=lambda u: (u in worked, u in same_pbk, u in same_address, popularity[u]),
+                        reverse=True)
+        if top_k is not None:
+            candidates = candidates[:top_k]
+        configs.extend(f"vless://{u}@{tail}" for u in candidates)
+        stats["kept"] += len(candidates)
+        stats["known_kept"] += sum(1 for u in candidates if u in worked)
+    return configs, stats
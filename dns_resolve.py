@@ -0,0 +1,227 @@
+# =============================================================================
+# Отдельная стадия DNS-резолва для коллектора
+# =============================================================================
+# Каждое уникальное имя резолвится один раз за запуск: asyncio + семафор
+# ограничивают число одновременных запросов. Результаты (в том числе NXDOMAIN)
+# лежат в кэше на диске и переживают перезапуски.
+# Срок записи — TTL из ответа DNS: если установлен dnspython, A-запись
+# запрашивается им (минимальный TTL по цепочке CNAME, для NXDOMAIN — TTL
+# из SOA, RFC 2308). Без него — системный socket.gethostbyname, который
+# TTL не отдаёт, и тогда срок фиксированный: POSITIVE_TTL / NEGATIVE_TTL.
+# Резолвер подменяемый: async-функция host -> IPv4 или None (имени нет),
+# либо пара (ответ, TTL в секундах или None); любое исключение считается
+# временной ошибкой и в кэш не попадает.
+# Коллектор резолвит пачками; BatchResolver держит для всех пачек один
+# event loop и один резолвер (с его пулом потоков).
+# =============================================================================
+
+import asyncio
+import json
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+DNS_CACHE_FILE  = os.path.join("cache", "dns.json")
+DNS_CONCURRENCY = 100
+DNS_TIMEOUT     = 5.0
+POSITIVE_TTL    = 6 * 3600     # сколько верим найденному адресу, если TTL из ответа неизвестен
+NEGATIVE_TTL    = 1 * 3600     # сколько верим NXDOMAIN, если в ответе нет SOA
+MAX_TTL         = 24 * 3600    # дольше не храним, какой бы TTL ни пришёл
+
+# Ошибки getaddrinfo, которые означают «такого имени нет», а не сбой сети
+NXDOMAIN_ERRORS = {getattr(socket, n) for n in ("EAI_NONAME", "EAI_NODATA") if hasattr(socket, n)}
+
+
+# ------------------------------- КЭШ -------------------------------
+class DnsCache:
+    """host -> [ip или None, unix-время истечения]. None — негативная запись."""
+
+    def __init__(self, path=DNS_CACHE_FILE):
+        self.path = path
+        self.entries = {}
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"DNS-кэш повреждён, начинаем заново: {e}")
+
+    def get(self, host, now=None):
+        """Возвращает (есть_в_кэше, ip)."""
+        entry = self.entries.get(host)
+        if entry and entry[1] > (now or time.time()):
+            return True, entry[0]
+        return False, None
+
+    def put(self, host, ip, ttl=None, now=None):
+        """ttl — из ответа DNS; None — фиксированный срок POSITIVE_TTL / NEGATIVE_TTL."""
+        if ttl is None:
+            ttl = POSITIVE_TTL if ip else NEGATIVE_TTL
+        ttl = min(ttl, MAX_TTL)
+        self.entries[host] = [ip, (now or time.time()) + ttl]
+
+    def save(self):
+        if not self.path:
+            return
+        now = time.time()
+        alive = {h: e for h, e in self.entries.items() if e[1] > now}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(alive, f)
+        os.replace(tmp, self.path)
+
+
+# ------------------------------- РЕЗОЛВ -------------------------------
+def make_system_resolver(concurrency=DNS_CONCURRENCY):
+    """Системный резолвер (socket.gethostbyname, как раньше в коллекторе) в своём пуле потоков."""
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def resolve(host):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(pool, socket.gethostbyname, host)
+        except socket.gaierror as e:
+            if e.errno in NXDOMAIN_ERRORS:
+                return None
+            raise
+
+    resolve.pool = pool
+    resolve.kind = "системный (gethostbyname), срок кэша фиксированный"
+    return resolve
+
+
+def negative_ttl(response):
+    """TTL отрицательного ответа (RFC 2308): min(TTL SOA, SOA.minimum); None — SOA в ответе нет."""
+    import dns.rdatatype
+
+    for rrset in response.authority if response is not None else ():
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return min(rrset.ttl, rrset[0].minimum)
+    return None
+
+
+def make_dnspython_resolver(nameservers=None, port=53, timeout=DNS_TIMEOUT):
+    """Резолвер на dnspython: пара (IPv4 или None, TTL из ответа). None — dnspython не установлен.
+
+    nameservers — свои серверы вместо /etc/resolv.conf.
+    """
+    try:
+        import dns.asyncresolver
+        import dns.resolver
+    except ImportError:
+        return None
+
+    try:
+        res = dns.asyncresolver.Resolver(configure=not nameservers)
+    except dns.resolver.NoResolverConfiguration:
+        return None
+    if nameservers:
+        res.nameservers = list(nameservers)
+        res.port = port
+    res.lifetime = timeout
+
+    async def resolve(host):
+        try:
+            answer = await res.resolve(host, "A")
+        except dns.resolver.NXDOMAIN as e:
+            return None, negative_ttl(next(iter(e.responses().values()), None))
+        except dns.resolver.NoAnswer as e:   # имя есть, IPv4 нет — как EAI_NODATA
+            return None, negative_ttl(e.kwargs.get("response"))
+        # срок ответа — минимальный TTL по всей цепочке CNAME -> A
+        return answer[0].address, min(rrset.ttl for rrset in answer.response.answer)
+
+    resolve.kind = "dnspython, срок кэша — TTL из ответов"
+    return resolve
+
+
+def make_resolver(concurrency=DNS_CONCURRENCY):
+    """dnspython, если установлен, иначе системный резолвер."""
+    return make_dnspython_resolver() or make_system_resolver(concurrency)
+
+
+def close_resolver(resolver):
+    pool = getattr(resolver, "pool", None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def resolve_many(hosts, cache=None, resolver=None, concurrency=DNS_CONCURRENCY, timeout=DNS_TIMEOUT):
+    """Резолвит уникальные имена. Возвращает ({host: ip или None}, статистика)."""
+    cache = cache if cache is not None else DnsCache(None)
+    own_resolver = resolver is None
+    resolver = resolver or make_resolver(concurrency)
+    sem = asyncio.Semaphore(concurrency)
+    stats = {"hosts": 0, "cached": 0, "resolved": 0, "nxdomain": 0, "failed": 0}
+    result = {}
+
+    async def one(host):
+        async with sem:
+            try:
+                answer = await asyncio.wait_for(resolver(host), timeout=timeout)
+            except Exception:
+                stats["failed"] += 1
+                result[host] = None
+                return
+        ip, ttl = answer if isinstance(answer, tuple) else (answer, None)
+        cache.put(host, ip, ttl)
+        result[host] = ip
+        stats["resolved" if ip else "nxdomain"] += 1
+
+    todo = []
+    for host in dict.fromkeys(hosts):
+        stats["hosts"] += 1
+        hit, ip = cache.get(host)
+        if hit:
+            stats["cached"] += 1
+            result[host] = ip
+        else:
+            todo.append(host)
+
+    try:
+        await asyncio.gather(*(one(h) for h in todo))
+    finally:
+        if own_resolver:
+            close_resolver(resolver)
+    return result, stats
+
+
+def resolve_hosts(hosts, cache=None, resolver=None, concurrency=DNS_CONCURRENCY, timeout=DNS_TIMEOUT):
+    """Синхронная обёртка над resolve_many для скриптов без event loop."""
+    return asyncio.run(resolve_many(hosts, cache, resolver, concurrency, timeout))
+
+
+class BatchResolver:
+    """resolve_hosts для многих пачек подряд: один event loop и один резолвер на все."""
+
+    def __init__(self, cache=None, resolver=None, concurrency=DNS_CONCURRENCY, timeout=DNS_TIMEOUT):
+        self.cache = cache if cache is not None else DnsCache(None)
+        self.own_resolver = resolver is None
+        self.resolver = resolver or make_resolver(concurrency)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+
+    @property
+    def kind(self):
+        return getattr(self.resolver, "kind", "свой")
+
+    def resolve(self, hosts):
+        """({host: ip или None}, статистика) — как resolve_hosts."""
+        return self.loop.run_until_complete(
+            resolve_many(hosts, self.cache, self.resolver, self.concurrency, self.timeout))
+
+    def close(self):
+        if self.own_resolver:
+            close_resolver(self.resolver)
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
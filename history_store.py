@@ -0,0 +1,295 @@
+# =============================================================================
+# История рабочих конфигов: один append-only файл вместо ротации old_work/
+# =============================================================================
+# Раньше каждый запуск сдвигал old_worked1..1439.txt на единицу и копировал
+# sidr_vless_work.txt в old_worked1.txt: 1440 файлов, сотня мегабайт и правка
+# каждого файла в git на каждом запуске. Здесь запуск — одна-две строки в
+# конце файла:
+#   U<TAB>url                        — новая ссылка в словаре, id = номер U-строки
+#   R<TAB>run<TAB>unixtime<TAB>+ids<TAB>-ids
+#                                    — разница с прошлым запуском: какие id
+#                                      появились и какие пропали
+#   S<TAB>run<TAB>unixtime<TAB>ids   — полный снимок, каждые SNAPSHOT_EVERY
+#                                      запусков, чтобы не проигрывать всё с начала
+# Запуск — множество ссылок, по одной на ключ дедупликации (get_dedup_key,
+# первая в файле); порядок строк исходного файла не хранится. Списки id
+# отсортированы, пишутся разностями соседних в base36 через запятую.
+# Время запусков, перенесённых из old_work/ (import), неизвестно — там 0.
+# Файл дописывается одним write; недописанная последняя строка (запуск упал
+# посреди записи) игнорируется при чтении и обрезается перед следующей
+# дозаписью, иначе новая запись склеилась бы с ней в одну строку.
+# Когда запусков становится больше 2 * KEEP_RUNS, файл переписывается с
+# последними KEEP_RUNS (окно как у old_work) и только нужными ссылками.
+#
+# Запуск:  python history_store.py import [каталог]   — перенести old_work/
+#          python history_store.py append <файл>      — дописать запуск
+#          python history_store.py show [запуск]      — ссылки запуска (по умолчанию последнего)
+#          python history_store.py compact [запусков]
+# =============================================================================
+
+import os
+import sys
+import time
+from bisect import bisect_right
+
+from vless_parse import get_dedup_key
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+HISTORY_FILE   = os.path.join("history", "work_history.txt")
+HEADER         = "#vless-history 1"
+SNAPSHOT_EVERY = 48          # запусков между полными снимками (~4 суток)
+KEEP_RUNS      = 1440        # окно истории, как было у old_work/
+DIGITS         = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def encode_ids(ids):
+    """Сортированные id -> «первый,разность,разность...» в base36."""
+    out, prev = [], 0
+    for i in sorted(ids):
+        n, gap = "", i - prev
+        while True:
+            gap, r = divmod(gap, 36)
+            n = DIGITS[r] + n
+            if not gap:
+                break
+        out.append(n)
+        prev = i
+    return ",".join(out)
+
+
+def decode_ids(text):
+    ids, prev = [], 0
+    if text:
+        for part in text.split(","):
+            prev += int(part, 36)
+            ids.append(prev)
+    return ids
+
+
+def run_urls(urls):
+    """Ссылки запуска: по одной на ключ дедупликации, первая в порядке файла."""
+    seen = {}
+    for url in urls:
+        url = url.strip()
+        if url.startswith("vless://") and "\t" not in url:
+            seen.setdefault(get_dedup_key(url), url)
+    return list(seen.values())
+
+
+class HistoryStore:
+    """Словарь ссылок и записи запусков; состояния запусков восстанавливаются проигрыванием."""
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self.urls = []            # id -> ссылка
+        self.url_ids = {}         # ссылка -> id
+        self.records = []         # (run, ts, +ids или снимок, -ids или None для снимка), строки как в файле
+        self.snapshots = []       # индексы снимков в records
+        self.partial_at = None    # смещение недописанного хвоста в файле, если он есть
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            if f.readline().decode("utf-8").rstrip("\r\n") != HEADER:
+                raise ValueError(f"{self.path}: не файл истории")
+            end = f.tell()
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    self.partial_at = end              # недописанный хвост
+                    print(f"{self.path}: недописанная последняя строка с байта {end}, отбрасываем")
+                    break
+                end += len(raw)
+                tag, _, rest = raw.decode("utf-8").rstrip("\r\n").partition("\t")
+                if tag == "U":
+                    self.url_ids[rest] = len(self.urls)
+                    self.urls.append(rest)
+                elif tag == "R":
+                    run, ts, added, removed = rest.split("\t")
+                    self.records.append((int(run), int(ts), added[1:], removed[1:]))
+                elif tag == "S":
+                    run, ts, ids = rest.split("\t")
+                    self.snapshots.append(len(self.records))
+                    self.records.append((int(run), int(ts), ids, None))
+
+    # ------------------------------- ЧТЕНИЕ -------------------------------
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def first_run(self):
+        return self.records[0][0] if self.records else None
+
+    @property
+    def latest_run(self):
+        return self.records[-1][0] if self.records else None
+
+    def _index(self, run):
+        i = run - self.first_run
+        if not self.records or not 0 <= i < len(self.records):
+            raise KeyError(f"запуска {run} нет в истории")
+        return i
+
+    def iter_states(self, start=0):
+        """(run, ts, множество id) для records[start:], проигрывая от ближайшего снимка."""
+        if start >= len(self.records):
+            return
+        base = self.snapshots[bisect_right(self.snapshots, start) - 1]
+        ids = set()
+        for i in range(base, len(self.records)):
+            run, ts, added, removed = self.records[i]
+            if removed is None:
+                ids = set(decode_ids(added))
+            else:
+                ids.update(decode_ids(added))
+                ids.difference_update(decode_ids(removed))
+            if i >= start:
+                yield run, ts, ids
+
+    def run_ids(self, run):
+        for _, _, ids in self.iter_states(self._index(run)):
+            return set(ids)
+
+    def run(self, run=None):
+        """Ссылки запуска run (по умолчанию последнего), в порядке словаря."""
+        if run is None:
+            run = self.latest_run
+        return [self.urls[i] for i in sorted(self.run_ids(run))]
+
+    def recent(self, count):
+        """Ссылки count последних запусков, от нового к старому (как old_worked1, 2, ...)."""
+        states = [sorted(ids) for _, _, ids in self.iter_states(max(0, len(self.records) - count))]
+        return [[self.urls[i] for i in ids] for ids in reversed(states)]
+
+    def window(self, runs=KEEP_RUNS):
+        """(ссылка, первый, последний запуск) для всего, что было в последних runs запусках;
+        от недавно виденных к давно виденным."""
+        first_seen, last_seen = {}, {}
+        prev = set()
+        for run, _, ids in self.iter_states(max(0, len(self.records) - runs)):
+            for i in ids - prev:
+                first_seen.setdefault(i, run)
+            for i in prev - ids:
+                last_seen[i] = run - 1
+            prev = set(ids)
+        for i in prev:
+            last_seen[i] = self.latest_run
+        rows = [(self.urls[i], first_seen[i], last) for i, last in last_seen.items()]
+        rows.sort(key=lambda r: -r[2])
+        return rows
+
+    # ------------------------------- ЗАПИСЬ -------------------------------
+    def _write(self, lines, mode="a"):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        new = mode == "w" or not os.path.exists(self.path)
+        if not new and self.partial_at is not None:
+            with open(self.path, "r+b") as f:
+                f.truncate(self.partial_at)
+        self.partial_at = None
+        with open(self.path, mode, encoding="utf-8") as f:
+            f.write((HEADER + "\n" if new else "") + "".join(line + "\n" for line in lines))
+
+    def append(self, urls, ts=None):
+        """Дописывает запуск; возвращает его номер."""
+        ts = int(time.time()) if ts is None else ts
+        lines, ids = [], set()
+        for url in run_urls(urls):
+            i = self.url_ids.get(url)
+            if i is None:
+                i = self.url_ids[url] = len(self.urls)
+                self.urls.append(url)
+                lines.append(f"U\t{url}")
+            ids.add(i)
+
+        run = (self.latest_run or 0) + 1
+        if not self.records or run % SNAPSHOT_EVERY == 0:
+            record = (run, ts, encode_ids(ids), None)
+            lines.append(f"S\t{run}\t{ts}\t{record[2]}")
+            self.snapshots.append(len(self.records))
+        else:
+            current = set()
+            for _, _, current in self.iter_states(len(self.records) - 1):
+                pass
+            record = (run, ts, encode_ids(ids - current), encode_ids(current - ids))
+            lines.append(f"R\t{run}\t{ts}\t+{record[2]}\t-{record[3]}")
+        self.records.append(record)
+        self._write(lines)
+        if len(self.records) > 2 * KEEP_RUNS:
+            self.compact(KEEP_RUNS)
+        return run
+
+    def compact(self, keep=KEEP_RUNS):
+        """Переписывает файл: последние keep запусков, первый — снимком, словарь — только нужное."""
+        start = max(0, len(self.records) - keep)
+        states = list(self.iter_states(start))
+        remap, urls = {}, []
+        for _, _, ids in states:
+            for i in sorted(ids):
+                if i not in remap:
+                    remap[i] = len(urls)
+                    urls.append(self.urls[i])
+
+        lines = [f"U\t{url}" for url in urls]
+        records, snapshots, prev = [], [], None
+        for n, (run, ts, ids) in enumerate(states):
+            ids = {remap[i] for i in ids}
+            if prev is None or run % SNAPSHOT_EVERY == 0:
+                snapshots.append(n)
+                records.append((run, ts, encode_ids(ids), None))
+                lines.append(f"S\t{run}\t{ts}\t{records[-1][2]}")
+            else:
+                records.append((run, ts, encode_ids(ids - prev), encode_ids(prev - ids)))
+                lines.append(f"R\t{run}\t{ts}\t+{records[-1][2]}\t-{records[-1][3]}")
+            prev = ids
+
+        tmp = self.path + ".tmp"
+        path, self.path = self.path, tmp
+        try:
+            self._write(lines, "w")
+        finally:
+            self.path = path
+        os.replace(tmp, path)
+        self.urls, self.records, self.snapshots = urls, records, snapshots
+        self.url_ids = {url: i for i, url in enumerate(urls)}
+
+
+def import_backups(store, backup_dir):
+    """Переносит old_worked*.txt в store, от старого к новому; время запусков — 0."""
+    from backup_index import backup_files, read_vless
+
+    files = backup_files(backup_dir)
+    for path in reversed(files):
+        store.append(read_vless(path), ts=0)
+    return len(files)
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else ""
+    store = HistoryStore()
+    if command == "import":
+        if len(store):
+            print(f"{HISTORY_FILE} уже есть ({len(store)} запусков), импорт пропущен")
+            return 0
+        count = import_backups(store, argv[2] if len(argv) > 2 else "old_work")
+        print(f"Перенесено запусков: {count}, ссылок в словаре: {len(store.urls)}")
+    elif command == "append" and len(argv) > 2:
+        if not os.path.exists(argv[2]):
+            print(f"{argv[2]} нет, запуск не записан")
+            return 0
+        with open(argv[2], "r", encoding="utf-8", errors="ignore") as f:
+            run = store.append(f)
+        print(f"Запуск {run}: {len(store.run_ids(run))} конфигов, в истории {len(store)} запусков")
+    elif command == "show":
+        for url in store.run(int(argv[2]) if len(argv) > 2 else None):
+            print(url)
+    elif command == "compact":
+        store.compact(int(argv[2]) if len(argv) > 2 else KEEP_RUNS)
+        print(f"Оставлено запусков: {len(store)}, ссылок: {len(store.urls)}")
+    else:
+        print("Команды: import [каталог] | append <файл> | show [запуск] | compact [запусков]")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
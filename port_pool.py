@@ -0,0 +1,181 @@
+# =============================================================================
+# Пул локальных портов для inbound'ов xray
+# =============================================================================
+# Раньше порт считался формулой (10000 + index % 45000, смещение +len+20 на
+# батч): без проверки, что он свободен, с переполнением за 65535 и с повторным
+# использованием, пока прошлый xray ещё не умер. Пул выдаёт непрерывные
+# диапазоны (create_batch_config_file нумерует inbound'ы подряд):
+#   * порт проверяется bind'ом на 127.0.0.1 (занят чужим — пропускается и
+#     какое-то время не предлагается);
+#   * диапазон возвращается только после выхода своего xray и ещё COOLDOWN
+#     секунд лежит в карантине — опоздавшие проверки старого батча не попадут
+#     в inbound нового;
+#   * поиск идёт по кругу от курсора, так что освобождённые порты берутся
+#     последними.
+# Если свободного диапазона нет, acquire ждёт освобождения. Статистика —
+# для сводки в конце запуска.
+# =============================================================================
+
+import os
+import socket
+import threading
+import time
+from array import array
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+PORT_FIRST     = 10000
+PORT_LAST      = 55000          # не включая
+POOL_HOST      = "127.0.0.1"
+COOLDOWN       = 2.0            # с, карантин диапазона после выхода xray
+FOREIGN_RETRY  = 60.0           # с, сколько не предлагать порт, занятый чужим процессом
+EXIT_WAIT      = 5.0            # с, сколько ждать выхода xray при возврате диапазона
+
+
+def port_is_free(port, host=POOL_HOST):
+    """bind как у xray: на POSIX Go ставит SO_REUSEADDR, TIME_WAIT ему не мешает."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        if os.name != "nt":
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind((host, port))
+        except OSError:
+            return False
+    return True
+
+
+class PortLease:
+    """Выданный диапазон [start, start + count)."""
+
+    def __init__(self, pool, start, count):
+        self.pool = pool
+        self.start = start
+        self.count = count
+        self.released = False
+
+    @property
+    def ports(self):
+        return range(self.start, self.start + self.count)
+
+    def release(self, proc=None):
+        """proc — xray, который слушал диапазон: порты вернутся после его выхода."""
+        self.pool.release(self, proc)
+
+
+class PortPool:
+    """Потокобезопасный пул; один на процесс проверки, общий для всех его потоков.
+    Шарды (shard_pool.py) получают непересекающиеся [first, last)."""
+
+    def __init__(self, first=PORT_FIRST, last=PORT_LAST, cooldown=COOLDOWN, check=port_is_free):
+        self.first = first
+        self.size = last - first
+        self.cooldown = cooldown
+        self.check = check
+        self.leased = bytearray(self.size)
+        self.ready_at = array("d", bytes(8 * self.size))   # раньше этого времени порт не выдаём
+        self.cursor = 0
+        self.cond = threading.Condition()
+        self.in_use = 0
+        self.peak = 0
+        self.acquired = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.foreign = 0             # сколько раз порт оказался занят чужим
+        self.leaked = 0              # диапазоны, чей xray не вышел за EXIT_WAIT
+
+    def _find(self, count, now):
+        """Начало непрерывного свободного диапазона от курсора по кругу или None."""
+        if count > self.size:
+            raise ValueError(f"диапазон {count} больше пула {self.size}")
+        i, run, scanned = self.cursor, 0, 0
+        while scanned < self.size + count:
+            if i + count - run > self.size:        # диапазон не переходит через конец пула
+                scanned += self.size - i
+                i, run = 0, 0
+                continue
+            if self.leased[i] or self.ready_at[i] > now:
+                run = 0
+            else:
+                run += 1
+                if run == count:
+                    return i - count + 1
+            i += 1
+            scanned += 1
+        return None
+
+    def _reserve(self, count, start_t, timeout):
+        """Под блокировкой: помечает кандидата занятым и возвращает его начало."""
+        waited = False
+        with self.cond:
+            while True:
+                start = self._find(count, time.time())
+                if start is not None:
+                    break
+                remaining = None if timeout is None else timeout - (time.perf_counter() - start_t)
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"нет свободного диапазона из {count} портов")
+                if not waited:
+                    waited = True
+                    self.waits += 1
+                # ждём освобождения или конца карантина ближайшего диапазона
+                self.cond.wait(min(self.cooldown, remaining) if remaining is not None else self.cooldown)
+            for i in range(start, start + count):
+                self.leased[i] = 1
+            self.cursor = (start + count) % self.size
+            self.in_use += count
+            if waited:
+                self.wait_time += time.perf_counter() - start_t
+        return start
+
+    def acquire(self, count, timeout=None):
+        """PortLease на count подряд идущих портов; ждёт, пока не освободится место.
+
+        timeout — сколько ждать (None — без ограничения); по истечении TimeoutError.
+        Кандидат резервируется под блокировкой, а bind-проверка идёт уже без неё,
+        чтобы потоки не выстраивались в очередь за сотнями системных вызовов.
+        """
+        start_t = time.perf_counter()
+        while True:
+            start = self._reserve(count, start_t, timeout)
+            busy = [i for i in range(start, start + count) if not self.check(self.first + i)]
+            with self.cond:
+                if not busy:
+                    self.peak = max(self.peak, self.in_use)
+                    self.acquired += 1
+                    return PortLease(self, self.first + start, count)
+                # занят чужим: весь кандидат назад, занятые порты — в отложенные
+                now = time.time()
+                for i in range(start, start + count):
+                    self.leased[i] = 0
+                for i in busy:
+                    self.ready_at[i] = now + FOREIGN_RETRY
+                self.in_use -= count
+                self.foreign += len(busy)
+                self.cond.notify_all()
+
+    def release(self, lease, proc=None):
+        """Возвращает диапазон после выхода proc (xray, который его слушал)."""
+        if lease.released:
+            return
+        if proc is not None:
+            try:
+                proc.wait(timeout=EXIT_WAIT)
+            except Exception:
+                with self.cond:
+                    self.leaked += 1
+                lease.released = True      # процесс жив — порты за ним так и остаются
+                return
+        lease.released = True
+        ready = time.time() + self.cooldown
+        with self.cond:
+            for i in range(lease.start - self.first, lease.start - self.first + lease.count):
+                self.leased[i] = 0
+                self.ready_at[i] = ready
+            self.in_use -= lease.count
+            self.cond.notify_all()
+
+    def summary(self):
+        with self.cond:
+            return (f"порты {self.first}-{self.first + self.size - 1}: выдано диапазонов {self.acquired}, "
+                    f"пик занятости {self.peak} ({self.peak / self.size:.1%}), сейчас {self.in_use}; "
+                    f"ждали {self.waits} раз ({self.wait_time:.1f} с), занято чужими {self.foreign}, "
+                    f"не освобождено {self.leaked}")
@@ -0,0 +1,203 @@
+# =============================================================================
+# Воронка дешёвых проверок перед xray
+# =============================================================================
+# Полная проверка (xray + generate_204) — самая дорогая: процесс, конфиг,
+# ожидание портов, запрос через туннель. Большая часть входа отсеивается
+# намного раньше, поэтому перед ней идут стадии без xray, каждая пропускает
+# дальше только выживших:
+#   tcp — connect на адрес:порт сервера;
+#   tls — TLS-рукопожатие с SNI из конфига. Для REALITY это тоже работает:
+#         сервер без ключа клиента проксирует рукопожатие на свой dest, и
+#         мёртвый или заблокированный сервер не ответит так же, как с TLS.
+#         Конфиги без TLS (security=none) проходят стадию без проверки.
+# У каждой стадии своя параллельность и таймаут; StageStats копит счётчики,
+# ошибки и время для итоговой сводки. Всё идёт в одном event loop.
+# На одном сервере часто живут десятки UUID с одинаковыми параметрами, а
+# результат стадии от UUID не зависит. Поэтому конфиги группируются по
+# ключу стадии: tcp — (адрес, порт), tls — ещё security и SNI (pbk/sid
+# REALITY рукопожатие без ключа клиента не меняют). Проверяется одна ссылка
+# группы, вердикт получают все.
+# =============================================================================
+
+import asyncio
+import time
+from collections import Counter
+
+from results_store import classify_error
+from socks_probe import SSL_CONTEXT
+from vless_parse import parse as parse_record
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+TCP_CONCURRENCY = 500
+TCP_TIMEOUT     = 3.0
+TLS_CONCURRENCY = 200
+TLS_TIMEOUT     = 5.0
+TLS_SECURITIES  = ("tls", "reality")
+
+
+class StageStats:
+    """Счётчики одной стадии воронки."""
+
+    def __init__(self, name, concurrency, timeout):
+        self.name = name
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.total = 0
+        self.passed = 0
+        self.skipped = 0          # прошли без проверки (стадия к ним не применима)
+        self.errors = Counter()   # класс ошибки (classify_error) -> сколько
+        self.elapsed = 0.0
+        self.check_ms = []        # время каждой проверки, мс
+        self.groups = None        # сколько групп (эндпоинтов) проверено; None — без группировки
+        self.groups_passed = None
+
+    def summary(self):
+        line = (f"{self.name}: {self.total} -> {self.passed} за {self.elapsed:.1f} с "
+                f"(параллельно {self.concurrency}")
+        if self.timeout is not None:
+            line += f", таймаут {self.timeout:g} с"
+        line += ")"
+        if self.groups is not None:
+            line += f", эндпоинтов {self.groups} -> {self.groups_passed}"
+        if self.check_ms:
+            ms = sorted(self.check_ms)
+            line += f", медиана {ms[len(ms) // 2]:.0f} мс"
+        if self.skipped:
+            line += f", без проверки {self.skipped}"
+        if self.errors:
+            line += "; " + ", ".join(f"{e} {n}" for e, n in self.errors.most_common(4))
+        return line
+
+
+def _error_text(e):
+    if isinstance(e, asyncio.TimeoutError):
+        return "timeout"
+    return (str(e) or e.__class__.__name__)[:60]
+
+
+# ------------------------------- СТАДИИ -------------------------------
+async def tcp_check(rec, timeout):
+    """None — порт открыт, иначе текст ошибки."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(rec.address, rec.port), timeout)
+    except Exception as e:
+        return _error_text(e)
+    writer.transport.abort()
+    return None
+
+
+async def tls_check(rec, timeout):
+    """None — рукопожатие с SNI конфига прошло (или TLS не нужен), иначе текст ошибки.
+
+    "skip" — стадия не применима к конфигу.
+    """
+    if rec.param("security", "none").lower() not in TLS_SECURITIES:
+        return "skip"
+    sni = rec.param("sni") or rec.address
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(rec.address, rec.port, ssl=SSL_CONTEXT, server_hostname=sni), timeout)
+    except Exception as e:
+        return _error_text(e)
+    writer.transport.abort()     # ответ не нужен — рвём без закрытия TLS-сессии
+    return None
+
+
+def endpoint_key(rec):
+    """Ключ группы для tcp: сам сервер."""
+    return rec.address, rec.port
+
+
+def tls_key(rec):
+    """Ключ группы для tls: всё, от чего зависит рукопожатие в tls_check."""
+    return rec.address, rec.port, rec.param("security", "none").lower(), rec.param("sni") or rec.address
+
+
+def count_endpoints(urls):
+    """Сколько разных серверов (endpoint_key) среди ссылок — для групповой сводки xray."""
+    return len({endpoint_key(rec) for rec in map(parse_record, urls) if rec is not None})
+
+
+STAGES = [
+    ("tcp", tcp_check, TCP_CONCURRENCY, TCP_TIMEOUT, endpoint_key),
+    ("tls", tls_check, TLS_CONCURRENCY, TLS_TIMEOUT, tls_key),
+]
+
+
+async def run_stage(stats, records, check, on_fail=None, key=None):
+    """Прогоняет (url, rec) через check; возвращает выживших в исходном порядке.
+
+    key(rec) — ключ группы: check идёт по одной записи группы, вердикт — на всю.
+    """
+    sem = asyncio.Semaphore(stats.concurrency)
+    if key is None:
+        group_of = list(range(len(records)))
+        leaders = records
+    else:
+        groups = {}
+        group_of = [groups.setdefault(key(rec), len(groups)) for _, rec in records]
+        leaders = [None] * len(groups)
+        for i, g in enumerate(group_of):
+            if leaders[g] is None:
+                leaders[g] = records[i]
+    group_verdicts = [None] * len(leaders)
+
+    async def one(g, rec):
+        async with sem:
+            start = time.perf_counter()
+            group_verdicts[g] = await check(rec, stats.timeout)
+            if group_verdicts[g] != "skip":
+                stats.check_ms.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    stats.total = len(records)
+    await asyncio.gather(*(one(g, rec) for g, (_, rec) in enumerate(leaders)))
+    stats.elapsed = time.perf_counter() - start
+    if key is not None:
+        stats.groups = len(leaders)
+        stats.groups_passed = sum(v in (None, "skip") for v in group_verdicts)
+
+    survivors = []
+    for (url, rec), g in zip(records, group_of):
+        verdict = group_verdicts[g]
+        if verdict == "skip":
+            stats.skipped += 1
+            verdict = None
+        if verdict is None:
+            survivors.append((url, rec))
+        else:
+            stats.errors[classify_error(verdict)] += 1
+            if on_fail:
+                on_fail(url, f"{stats.name}: {verdict}")
+    stats.passed = len(survivors)
+    return survivors
+
+
+async def funnel(urls, stages=STAGES, on_fail=None):
+    """Прогоняет urls через стадии по очереди. Возвращает (выжившие urls, [StageStats]).
+
+    stages — (имя, check, параллельность, таймаут, ключ группы или None).
+
+    on_fail(url, error) вызывается для каждого отсеянного, error — "стадия: причина".
+    Неразборчивые ссылки отсеиваются сразу (ошибка "parse").
+    """
+    records = []
+    for url in urls:
+        rec = parse_record(url)
+        if rec is None or not rec.address:
+            if on_fail:
+                on_fail(url, "parse")
+            continue
+        records.append((url, rec))
+
+    all_stats = []
+    for name, check, concurrency, timeout, key in stages:
+        stats = StageStats(name, concurrency, timeout)
+        records = await run_stage(stats, records, check, on_fail, key)
+        all_stats.append(stats)
+    return [url for url, _ in records], all_stats
+
+
+def prefilter(urls, stages=STAGES, on_fail=None):
+    """Синхронная обёртка над funnel для скриптов на потоках."""
+    return asyncio.run(funnel(urls, stages, on_fail))
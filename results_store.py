@@ -0,0 +1,386 @@
+# =============================================================================
+# Хранилище результатов проверок (SQLite) между запусками
+# =============================================================================
+# work_test.py и Uidd_gen_work.py пишут сюда каждую проверку: ключ
+# дедупликации, время, задержку и класс ошибки (runs.source — какой скрипт).
+# Запись идёт через отдельный поток: чекеры только кладут строку в очередь,
+# поток пишет пачками в одной транзакции, база в режиме WAL — проверки не
+# ждут диска.
+# Ключ и ссылка (по 200-300 символов) хранятся один раз в таблице urls,
+# строка probes ссылается на неё числом: проверок на ключ — сотни за окно
+# хранения. Базу старой схемы (ссылка в каждой строке probes) connect()
+# один раз переносит на новую.
+#
+# Для «сколько работает» ведётся таблица непрерывных серий (streaks): конфиг,
+# проверенный успешно в этом запуске и в предыдущем, продолжает серию, иначе
+# серия начинается заново. Для не прошедших — счётчик неудач подряд (failures).
+# time_work.py и sidr_vless_time_one_ip.py берут отсюда время начала серии
+# вместо разбора комментариев «(unixtime N)»; коллектор — ключи, которые
+# давно подряд не проходят проверку. Серии и неудачи ведёт только work_test
+# (track_streaks), чтение по ним и по проверкам идёт с фильтром по source:
+# проверки Uidd (сгенерированные UUID, свой кэш в workflow) с ними не смешиваются.
+# При первом открытии серии засеваются из старого sidr_vless_time.txt.
+# =============================================================================
+
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+from vless_parse import clean_url, get_dedup_key
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+RESULTS_DB      = os.path.join("cache", "probes.db")
+SEED_TIME_FILE  = "sidr_vless_time.txt"
+BATCH_ROWS      = 500            # строк в одной транзакции писателя
+KEEP_OK_DAYS    = 120            # успешные проверки храним как окно old_work (1440 запусков)
+KEEP_ERROR_DAYS = 14             # неудачные — короче, их на порядок больше
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    source   TEXT NOT NULL,
+    started  INTEGER NOT NULL,
+    finished INTEGER
+);
+CREATE TABLE IF NOT EXISTS urls (
+    id  INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL            -- ссылка из последнего запуска, где ключ встретился
+);
+CREATE TABLE IF NOT EXISTS probes (
+    run     INTEGER NOT NULL,
+    key_id  INTEGER NOT NULL,    -- urls.id
+    ts      INTEGER NOT NULL,
+    latency INTEGER,
+    error   TEXT
+);
+CREATE INDEX IF NOT EXISTS probes_key_ts ON probes(key_id, ts);
+CREATE INDEX IF NOT EXISTS probes_ts ON probes(ts);
+CREATE INDEX IF NOT EXISTS probes_run ON probes(run);
+CREATE TABLE IF NOT EXISTS streaks (
+    key      TEXT PRIMARY KEY,
+    url      TEXT NOT NULL,
+    first_ts INTEGER NOT NULL,
+    last_ts  INTEGER NOT NULL,
+    last_run INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS failures (
+    key     TEXT PRIMARY KEY,
+    count   INTEGER NOT NULL,
+    last_ts INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name  TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def classify_error(error):
+    """Короткий класс ошибки проверки; None — проверка прошла."""
+    if error is None:
+        return None
+    e = error.lower()
+    if "timeout" in e or "deadline" in e:
+        return "timeout"
+    if e.startswith("socks"):
+        return "socks"
+    if e.startswith("http"):
+        return "http"
+    if "ssl" in e or "tls" in e or "certificate" in e:
+        return "tls"
+    if "refused" in e or "connect call failed" in e:
+        return "refused"
+    if e in ("core", "dead"):
+        return e
+    return "other"
+
+
+MIGRATE_URLS = """
+BEGIN;
+ALTER TABLE probes RENAME TO probes_old;
+DROP INDEX IF EXISTS probes_key_ts;
+DROP INDEX IF EXISTS probes_ts;
+DROP INDEX IF EXISTS probes_run;
+%s
+INSERT INTO urls (key, url) SELECT key, url FROM (SELECT key, url, MAX(ts) FROM probes_old GROUP BY key);
+INSERT INTO probes SELECT p.run, u.id, p.ts, p.latency, p.error FROM probes_old p JOIN urls u ON u.key = p.key;
+DROP TABLE probes_old;
+COMMIT;
+""" % SCHEMA
+
+
+def connect(path=RESULTS_DB):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if "url" in {row[1] for row in conn.execute("PRAGMA table_info(probes)")}:
+        # старая схема: ссылка в каждой строке probes — переносим в urls и сжимаем файл
+        conn.executescript(MIGRATE_URLS)
+        conn.execute("VACUUM")
+    else:
+        conn.executescript(SCHEMA)
+    return conn
+
+
+# ------------------------------- ТЕКСТОВАЯ ИСТОРИЯ -------------------------------
+def read_time_file(path=SEED_TIME_FILE):
+    """Пары (url, unixtime) из sidr_vless_time.txt — комментарий и следующая за ним vless-строка."""
+    entries = []
+    if not path or not os.path.exists(path):
+        return entries
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        match = re.search(r'\(unixtime\s*(\d+)\)', line) or re.search(r'unix:\s*(\d+)', line)
+        if match:
+            add_ts = int(match.group(1))
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith('vless://'):
+                i += 1
+            if i < len(lines):
+                url = clean_url(lines[i])
+                if url.startswith('vless://'):
+                    entries.append((url, add_ts))
+        i += 1
+    return entries
+
+
+def plural(n, one, few, many):
+    if 11 <= n % 100 <= 14:
+        return many
+    if n % 10 == 1:
+        return one
+    if 2 <= n % 10 <= 4:
+        return few
+    return many
+
+
+def format_uptime(seconds):
+    """«2 дня 3 часа 5 минут 7 секунд» — старшие нулевые части опускаются."""
+    days = seconds // 86400
+    hours = (seconds % 86400) // 3600
+    minutes = (seconds % 3600) // 60
+    seconds = seconds % 60
+
+    parts = []
+    if days > 0:
+        parts.append(f"{days} {plural(days,'день','дня','дней')}")
+    if hours > 0 or days > 0:
+        parts.append(f"{hours} {plural(hours,'час','часа','часов')}")
+    if minutes > 0 or hours > 0 or days > 0:
+        parts.append(f"{minutes} {plural(minutes,'минута','минуты','минут')}")
+    parts.append(f"{seconds} {plural(seconds,'секунда','секунды','секунд')}")
+    return " ".join(parts)
+
+
+# ------------------------------- ЗАПИСЬ -------------------------------
+class ResultsWriter:
+    """Фоновая запись проверок одного запуска. add() потокобезопасен и не ждёт диска.
+
+    track_streaks=True — запуск определяет «работает» (work_test): по закрытии
+    успешные ключи продолжают или начинают серии, неуспешные копят неудачи.
+    Конструктор ждёт, пока поток откроет базу (и перенесёт старую схему),
+    чтобы ResultsStore, открытый следом, видел уже новую.
+    """
+
+    def __init__(self, source, path=RESULTS_DB, track_streaks=False, batch_rows=BATCH_ROWS,
+                 seed_file=SEED_TIME_FILE):
+        self.source = source
+        self.path = path
+        self.seed_file = seed_file
+        self.track_streaks = track_streaks
+        self.batch_rows = batch_rows
+        self.queue = queue.Queue()
+        self.count = 0
+        self.error = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="results-writer", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def add(self, url, latency=None, error=None, ts=None):
+        """latency — мс для успешной проверки; error — текст ошибки для неудачной."""
+        self.queue.put((url, latency, error, int(ts or time.time())))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            print(f"Хранилище результатов: запись не удалась: {self.error}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------------------------------------------------------------------
+    def _run(self):
+        conn = None
+        done = False
+        try:
+            conn = connect(self.path)
+            if self.track_streaks:
+                seed_streaks(conn, self.seed_file)
+            run = conn.execute("INSERT INTO runs (source, started) VALUES (?, ?)",
+                               (self.source, int(time.time()))).lastrowid
+            conn.commit()
+            self.ready.set()
+            ids = {}
+            while not done:
+                batch = [self.queue.get()]
+                while len(batch) < self.batch_rows:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is None:
+                    batch.pop()
+                    done = True
+                with conn:
+                    insert_probes(conn, run, batch, ids)
+                self.count += len(batch)
+            with conn:
+                conn.execute("UPDATE runs SET finished = ? WHERE id = ?", (int(time.time()), run))
+                if self.track_streaks:
+                    update_streaks(conn, run, self.source)
+                prune(conn)
+        except Exception as e:
+            self.error = e
+            self.ready.set()
+            while not done and self.queue.get() is not None:   # дочитываем очередь до close()
+                pass
+        finally:
+            if conn:
+                conn.close()
+
+
+def probe_row(url, latency, error, ts):
+    """(ключ, время, задержка, класс ошибки) одной проверки."""
+    if error is None and latency is None:
+        error = "dead"
+    return get_dedup_key(url), ts, latency if error is None else None, classify_error(error)
+
+
+def url_id(conn, ids, key, url):
+    """id ключа в urls; ids — кэш ключ -> id на время запуска."""
+    i = ids.get(key)
+    if i is None:
+        conn.execute("INSERT INTO urls (key, url) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET url = excluded.url",
+                     (key, url))
+        i = ids[key] = conn.execute("SELECT id FROM urls WHERE key = ?", (key,)).fetchone()[0]
+    return i
+
+
+def insert_probes(conn, run, items, ids):
+    """Пишет проверки (url, latency, error, ts) запуска run."""
+    rows = []
+    for url, latency, error, ts in items:
+        key, ts, latency, error = probe_row(url, latency, error, ts)
+        rows.append((run, url_id(conn, ids, key, url), ts, latency, error))
+    conn.executemany("INSERT INTO probes VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def seed_streaks(conn, time_file=SEED_TIME_FILE):
+    """Один раз переносит серии из sidr_vless_time.txt, чтобы аптайм не обнулился."""
+    if conn.execute("SELECT 1 FROM meta WHERE name = 'seeded'").fetchone():
+        return
+    with conn:
+        for url, ts in read_time_file(time_file):
+            # last_run = 0: «успешен в предыдущем запуске» для самого первого запуска
+            conn.execute("INSERT OR IGNORE INTO streaks VALUES (?, ?, ?, ?, 0)", (get_dedup_key(url), url, ts, ts))
+        conn.execute("INSERT INTO meta VALUES ('seeded', ?)", (str(int(time.time())),))
+
+
+def update_streaks(conn, run, source):
+    prev = conn.execute("SELECT MAX(id) FROM runs WHERE source = ? AND id < ? AND finished IS NOT NULL",
+                        (source, run)).fetchone()[0] or 0
+    conn.execute("""
+        INSERT INTO streaks (key, url, first_ts, last_ts, last_run)
+        SELECT u.key, u.url, MIN(p.ts), MAX(p.ts), ? FROM probes p JOIN urls u ON u.id = p.key_id
+        WHERE p.run = ? AND p.error IS NULL GROUP BY p.key_id
+        ON CONFLICT(key) DO UPDATE SET
+            url = excluded.url,
+            first_ts = CASE WHEN streaks.last_run = ? THEN streaks.first_ts ELSE excluded.first_ts END,
+            last_ts = excluded.last_ts,
+            last_run = excluded.last_run
+    """, (run, run, prev))
+    conn.execute("DELETE FROM failures WHERE key IN (SELECT u.key FROM probes p JOIN urls u ON u.id = p.key_id "
+                 "WHERE p.run = ? AND p.error IS NULL)", (run,))
+    conn.execute("""
+        INSERT INTO failures (key, count, last_ts)
+        SELECT u.key, 1, MAX(p.ts) FROM probes p JOIN urls u ON u.id = p.key_id
+        WHERE p.run = ? GROUP BY p.key_id HAVING SUM(p.error IS NULL) = 0
+        ON CONFLICT(key) DO UPDATE SET count = failures.count + 1, last_ts = excluded.last_ts
+    """, (run,))
+
+
+def prune(conn, now=None):
+    now = now or time.time()
+    conn.execute("DELETE FROM probes WHERE error IS NULL AND ts < ?", (int(now - KEEP_OK_DAYS * 86400),))
+    conn.execute("DELETE FROM probes WHERE error IS NOT NULL AND ts < ?", (int(now - KEEP_ERROR_DAYS * 86400),))
+    conn.execute("DELETE FROM urls WHERE id NOT IN (SELECT key_id FROM probes)")
+    conn.execute("DELETE FROM streaks WHERE last_ts < ?", (int(now - KEEP_OK_DAYS * 86400),))
+    # Ключ, выпавший из проверок, через KEEP_ERROR_DAYS снова считается непроверенным
+    conn.execute("DELETE FROM failures WHERE last_ts < ?", (int(now - KEEP_ERROR_DAYS * 86400),))
+
+
+# ------------------------------- ЧТЕНИЕ -------------------------------
+class ResultsStore:
+    """Чтение хранилища. Если базы нет — available=False, и скрипты берут текстовые файлы."""
+
+    def __init__(self, path=RESULTS_DB):
+        self.path = path
+        self.conn = None
+        if os.path.exists(path):
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    @property
+    def available(self):
+        return self.conn is not None
+
+    def latest_run(self, source):
+        row = self.conn.execute("SELECT MAX(id) FROM runs WHERE source = ? AND finished IS NOT NULL",
+                                (source,)).fetchone()
+        return row[0]
+
+    def current_streaks(self, source="work_test"):
+        """[(url, начало серии)] для ключей, прошедших последний запуск source, от старых к новым."""
+        run = self.latest_run(source)
+        if run is None:
+            return []
+        return self.conn.execute("SELECT url, first_ts FROM streaks WHERE last_run = ? ORDER BY first_ts, key",
+                                 (run,)).fetchall()
+
+    def streak_starts(self, source="work_test"):
+        """{ключ: начало серии} для ключей, прошедших последний запуск source."""
+        run = self.latest_run(source)
+        if run is None:
+            return {}
+        return dict(self.conn.execute("SELECT key, first_ts FROM streaks WHERE last_run = ?", (run,)))
+
+    def failure_counts(self):
+        """{ключ: неудач подряд} по серийному чекеру."""
+        return dict(self.conn.execute("SELECT key, count FROM failures"))
+
+    def key_stats(self, source="work_test"):
+        """(ключ, проверок, успешных, время последней) по всем хранимым проверкам source."""
+        return self.conn.execute(
+            "SELECT u.key, COUNT(*), SUM(p.error IS NULL), MAX(p.ts) FROM probes p "
+            "JOIN runs r ON r.id = p.run JOIN urls u ON u.id = p.key_id WHERE r.source = ? GROUP BY p.key_id",
+            (source,))
+
+    def dead_keys(self, min_fails):
+        """Ключи, не прошедшие последние min_fails проверок подряд (серийный чекер, work_test)."""
+        return {row[0] for row in self.conn.execute("SELECT key FROM failures WHERE count >= ?", (min_fails,))}
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
@@ -0,0 +1,98 @@
+# =============================================================================
+# Адаптивное расписание перепроверок для work_test.py
+# =============================================================================
+# По истории из хранилища проверок (results_store.py) каждый конфиг попадает
+# в одну из групп:
+#   quick — давно и без перерывов работает: короткий таймаут; не прошёл быструю
+#           проверку — перепроверяется полной, чтобы не потерять медленных;
+#   full  — новый, нестабильный или пора повторить после неудач: полный таймаут;
+#   skip  — не проходит подряд больше FREE_FAILS раз: пробуем с экспоненциальной
+#           паузой (2, 4, 8, 16 запусков, не больше BACKOFF_MAX_RUNS).
+#           FREE_FAILS = None выключает пропуски совсем.
+# Решение — чистая функция от состояния ключа и времени, поэтому то же самое
+# прогоняется на истории old_work (benchmarks.py retest).
+# =============================================================================
+
+from typing import NamedTuple, Optional
+
+from vless_parse import get_dedup_key
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+RUN_INTERVAL     = 2 * 3600     # запуски work_test идут каждые 2 часа (update-vless.yml)
+STABLE_AGE       = 24 * 3600    # серия такой длины считается стабильной
+QUICK_TIMEOUT    = 15           # таймаут быстрой проверки стабильных, с
+FREE_FAILS       = 48           # столько неудач подряд (4 суток) проверяем каждый запуск; None — пропусков нет
+BACKOFF_MAX_RUNS = 16           # дольше этого мёртвый конфиг не пропускаем (~32 часа)
+# Цена пропусков на истории old_work (benchmarks.py retest), FREE_FAILS/BACKOFF_MAX_RUNS —
+# экономия проверок и доля найденных живых: 24/8 — 40% и 98.95%; 36/16 — 30.5% и 99.38%;
+# 48/8 — 20.8% и 99.75%; 48/16 — 22.0% и 99.71%; 96/16 — 4.9% и 99.99%.
+
+
+class KeyHistory(NamedTuple):
+    streak_start: Optional[int]   # начало текущей серии успехов; None — последняя проверка неудачна
+    fails: int                    # неудач подряд
+    last_ts: int                  # время последней проверки
+    attempts: int
+    successes: int
+
+
+def decide(history, now):
+    """'quick', 'full' или 'skip' для ключа с историей history (None — ключ новый)."""
+    if history is None:
+        return "full"
+    if history.fails == 0 and history.streak_start is not None and now - history.streak_start >= STABLE_AGE:
+        return "quick"
+    if FREE_FAILS is not None and history.fails > FREE_FAILS:
+        pause_runs = min(2 ** (history.fails - FREE_FAILS), BACKOFF_MAX_RUNS)
+        # ползапуска запаса: запуски по cron приходят не секунда в секунду
+        if now - history.last_ts < (pause_runs - 0.5) * RUN_INTERVAL:
+            return "skip"
+    return "full"
+
+
+def priority(history):
+    """Порядок внутри full: новые и чаще работавшие — раньше."""
+    if history is None:
+        return (1, 0.0)
+    return (0, history.successes / max(1, history.attempts))
+
+
+class RetestPlan:
+    def __init__(self):
+        self.quick = []
+        self.full = []
+        self.skipped = []
+
+    def summary(self):
+        return (f"быстрая проверка: {len(self.quick)}, полная: {len(self.full)}, "
+                f"отложено по backoff: {len(self.skipped)}")
+
+
+def load_histories(store, source="work_test"):
+    """KeyHistory по ключам из хранилища; пустой словарь, если хранилища нет."""
+    if not store.available:
+        return {}
+    streaks = store.streak_starts(source)
+    fails = store.failure_counts()
+    histories = {}
+    for key, attempts, successes, last_ts in store.key_stats(source):
+        histories[key] = KeyHistory(streaks.get(key), fails.get(key, 0), last_ts, attempts, successes)
+    return histories
+
+
+def plan_retests(urls, histories, now):
+    """Раскладывает urls по группам; внутри full — по priority()."""
+    plan = RetestPlan()
+    full = []
+    for url in urls:
+        history = histories.get(get_dedup_key(url))
+        verdict = decide(history, now)
+        if verdict == "quick":
+            plan.quick.append(url)
+        elif verdict == "skip":
+            plan.skipped.append(url)
+        else:
+            full.append((priority(history), url))
+    full.sort(key=lambda item: item[0], reverse=True)
+    plan.full = [url for _, url in full]
+    return plan
@@ -0,0 +1,158 @@
+# =============================================================================
+# Шардированный прогон проверок по процессам
+# =============================================================================
+# work_test.py и Uidd_gen_work.py гоняют все проверки в одном процессе на
+# сотнях потоков: сборка JSON-конфигов, разбор ссылок, event loop'ы проверок
+# упираются в GIL, и на многоядерном раннере занято одно ядро. Здесь вход
+# делится на N процессов (по умолчанию — по числу ядер):
+#   * каждый шард получает свою часть входа (батчи раздаются по кругу, так
+#     что состав батчей тот же, что в одном процессе) и свой непересекающийся
+#     диапазон портов для PortPool — xray разных шардов друг другу не мешают;
+#   * в шарде работает обычная функция проверки со своими потоками, xray,
+#     адаптивными таймаутами;
+#   * всё, что родителю нужно знать, шард отдаёт через emit(сообщение):
+#     сообщения идут одной multiprocessing.Queue и приходят родителю по мере
+#     проверки, а не в конце — родитель пишет их в results_store, двигает
+#     прогресс и печатает LIVE, как в однопроцессном режиме. Чтобы не платить
+#     pickle и запись в pipe за каждое, шард копит их и отправляет пачкой
+#     раз в FLUSH_EVERY с или по FLUSH_COUNT штук.
+# Процессы — spawn (так же на Windows, где fork нет); функция шарда должна
+# быть на верхнем уровне модуля, аргументы — picklable. Шард, упавший с
+# исключением или умерший, печатается и пропускается, остальные доделывают.
+# =============================================================================
+
+import multiprocessing
+import os
+import queue as queue_module
+import threading
+import traceback
+
+from port_pool import PORT_FIRST, PORT_LAST
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+POLL_INTERVAL = 1.0      # с; как часто проверять, живы ли шарды, пока сообщений нет
+FLUSH_EVERY   = 0.2      # с; задержка сообщений шарда не больше этой
+FLUSH_COUNT   = 500      # сообщений в пачке, после которых отправляем, не дожидаясь таймера
+
+
+def shard_count(setting, units):
+    """Сколько шардов запускать: setting (0/None — по числу ядер), не больше units батчей."""
+    n = setting or os.cpu_count() or 1
+    return max(1, min(n, units))
+
+
+def partition(items, shards, unit=1):
+    """Делит items на shards частей: куски по unit раздаются по кругу."""
+    parts = [[] for _ in range(shards)]
+    for n, i in enumerate(range(0, len(items), unit)):
+        parts[n % shards].extend(items[i:i + unit])
+    return parts
+
+
+def port_ranges(shards, first=PORT_FIRST, last=PORT_LAST):
+    """Непересекающиеся диапазоны портов [first, last) поровну на шарды."""
+    size = (last - first) // shards
+    return [(first + i * size, first + (i + 1) * size) for i in range(shards)]
+
+
+class _Emitter:
+    """emit шарда: копит сообщения и отправляет пачками (таймер или FLUSH_COUNT)."""
+
+    def __init__(self, shard, queue):
+        self.shard = shard
+        self.queue = queue
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="shard-flush", daemon=True)
+        self.thread.start()
+
+    def __call__(self, message):
+        with self.lock:
+            self.buffer.append(message)
+            if len(self.buffer) >= FLUSH_COUNT:
+                self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.queue.put((self.shard, "batch", self.buffer))
+            self.buffer = []
+
+    def _run(self):
+        while not self.stopped.wait(FLUSH_EVERY):
+            with self.lock:
+                self._flush()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        with self.lock:
+            self._flush()
+
+
+def _shard_main(target, shard, items, ports, args, queue):
+    emit = _Emitter(shard, queue)
+    try:
+        target(shard, items, ports, emit, *args)
+    except BaseException:
+        emit.close()
+        queue.put((shard, "error", traceback.format_exc()))
+    else:
+        emit.close()
+        queue.put((shard, "done", None))
+
+
+def run_sharded(target, items, shards, args=(), unit=1, ports=(PORT_FIRST, PORT_LAST)):
+    """Запускает target(shard, items, (first, last), emit, *args) в shards процессах.
+
+    Генератор (shard, сообщение) по мере прихода от всех шардов; заканчивается,
+    когда все шарды завершились.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    procs = []
+    for shard, (part, shard_ports) in enumerate(zip(partition(items, shards, unit), port_ranges(shards, *ports))):
+        proc = ctx.Process(target=_shard_main, args=(target, shard, part, shard_ports, args, queue),
+                           name=f"shard-{shard}", daemon=True)
+        proc.start()
+        procs.append(proc)
+
+    running = set(range(len(procs)))
+
+    def handle(shard, kind, payload):
+        """Сообщения пачки или [] для служебных."""
+        if kind == "batch":
+            return payload
+        running.discard(shard)
+        if kind == "error":
+            print(f"Шард {shard} упал:\n{payload}")
+        return []
+
+    try:
+        while running:
+            try:
+                item = queue.get(timeout=POLL_INTERVAL)
+            except queue_module.Empty:
+                dead = [s for s in running if not procs[s].is_alive()]
+                if not dead:
+                    continue
+                # умерший мог успеть положить последние сообщения — дочитываем их
+                while True:
+                    try:
+                        item = queue.get(timeout=POLL_INTERVAL)
+                    except queue_module.Empty:
+                        break
+                    for message in handle(*item):
+                        yield item[0], message
+                for s in dead:
+                    if s in running:
+                        running.discard(s)
+                        print(f"Шард {s} завершился без результата (код {procs[s].exitcode})")
+                continue
+            for message in handle(*item):
+                yield item[0], message
+    finally:
+        for proc in procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.kill()
@@ -1,14 +1,28 @@
 import re
 
+from vless_parse import parse as parse_record
+
 input_file  = "sidr_vless_time.txt"
 output_file = "sidr_vless_time_one_ip.txt"
 
 seen_ips = set()
 entries = []
 
-# Регулярка только для IP
-pattern_ip = re.compile(r'@([0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3})[:]')
+# Берём только конфиги, где адрес сервера — IPv4
+pattern_ip = re.compile(r'[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}')
+
+
+def add_entry(comment, vless):
+    rec = parse_record(vless)
+    if rec and pattern_ip.fullmatch(rec.address):
+        ip = rec.address
+        if ip not in seen_ips:
+            seen_ips.add(ip)
+            entries.append((comment, vless))
 
+
+# sidr_vless_time.txt только что собран time_work.py: начало серий там уже из
+# хранилища проверок (cache/probes.db), а набор ссылок — ровно рабочий список
 with open(input_file, encoding="utf-8") as f:
     lines = [line.rstrip() for line in f]
 
@@ -18,13 +32,7 @@ while i < len(lines) - 1:
     vless   = lines[i + 1].strip()
 
     if comment.startswith("# работает"):
-        ip_match = pattern_ip.search(vless)
-        if ip_match:
-            ip = ip_match.group(1)
-            if ip not in seen_ips:
-                seen_ips.add(ip)
-                entries.append((comment, vless))
-
+        add_entry(comment, vless)
         i += 2
         continue
 
@@ -0,0 +1,164 @@
+# =============================================================================
+# Лёгкий asyncio-пробер: SOCKS5 к локальному inbound xray + минимальный GET
+# =============================================================================
+# Вместо requests.get через socks5 (поток ОС, новая Session и пул urllib3 на
+# каждую проверку) — одно соединение на asyncio-стримах:
+#   1. SOCKS5 без авторизации, CONNECT по имени (как socks5h — DNS на стороне xray)
+#   2. TLS поверх туннеля (для https://), сертификат не проверяется, как verify=False
+#   3. GET с Connection: close, читаем только строку статуса
+# Время считается по этапам: connect (туннель готов), tls, first_byte.
+# Тысячи проверок идут в одном event loop, параллельность — через семафор.
+# =============================================================================
+
+import asyncio
+import ssl
+import struct
+import time
+from urllib.parse import urlsplit
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+TEST_DOMAIN       = "https://www.google.com/generate_204"
+PROBE_TIMEOUT     = 30
+PROBE_CONCURRENCY = 1000
+SOCKS_HOST        = "127.0.0.1"
+
+SOCKS_REPLIES = {
+    1: "socks: general failure", 2: "socks: not allowed", 3: "socks: network unreachable",
+    4: "socks: host unreachable", 5: "socks: connection refused", 6: "socks: TTL expired",
+    7: "socks: command not supported", 8: "socks: address type not supported",
+}
+
+
+def _insecure_context():
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+SSL_CONTEXT = _insecure_context()
+
+
+def new_result(port):
+    return {"port": port, "ok": False, "status": None, "connect_ms": None, "tls_ms": None,
+            "first_byte_ms": None, "latency": None, "error": None}
+
+
+# ------------------------------- SOCKS5 -------------------------------
+async def socks5_connect(reader, writer, host, port):
+    writer.write(b"\x05\x01\x00")                       # версия 5, один метод: без авторизации
+    await writer.drain()
+    ver, method = await reader.readexactly(2)
+    if ver != 5 or method != 0:
+        raise ConnectionError("socks: метод авторизации не принят")
+
+    name = host.encode("idna")
+    writer.write(b"\x05\x01\x00\x03" + bytes([len(name)]) + name + struct.pack("!H", port))
+    await writer.drain()
+    ver, rep, _, atyp = await reader.readexactly(4)
+    if rep != 0:
+        raise ConnectionError(SOCKS_REPLIES.get(rep, f"socks: код {rep}"))
+    # Пропускаем адрес привязки из ответа
+    if atyp == 1:
+        await reader.readexactly(4 + 2)
+    elif atyp == 4:
+        await reader.readexactly(16 + 2)
+    elif atyp == 3:
+        length = (await reader.readexactly(1))[0]
+        await reader.readexactly(length + 2)
+    else:
+        raise ConnectionError(f"socks: неизвестный тип адреса {atyp}")
+
+
+# ------------------------------- ПРОВЕРКА -------------------------------
+async def _probe(port, url, socks_host, result):
+    target = urlsplit(url)
+    host = target.hostname
+    https = target.scheme == "https"
+    target_port = target.port or (443 if https else 80)
+    path = (target.path or "/") + (f"?{target.query}" if target.query else "")
+
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(socks_host, port)
+    try:
+        await socks5_connect(reader, writer, host, target_port)
+        result["connect_ms"] = round((time.perf_counter() - start) * 1000)
+
+        if https:
+            tls_start = time.perf_counter()
+            await writer.start_tls(SSL_CONTEXT, server_hostname=host)
+            result["tls_ms"] = round((time.perf_counter() - tls_start) * 1000)
+
+        request_start = time.perf_counter()
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+                     f"User-Agent: Mozilla/5.0\r\nAccept: */*\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        result["first_byte_ms"] = round((time.perf_counter() - request_start) * 1000)
+        result["latency"] = round((time.perf_counter() - start) * 1000)
+
+        parts = status_line.split()
+        if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+            raise ConnectionError("пустой или не-HTTP ответ")
+        result["status"] = int(parts[1])
+        result["ok"] = result["status"] == 204
+        if not result["ok"]:
+            result["error"] = f"HTTP {result['status']}"
+    finally:
+        writer.close()
+
+
+async def probe(port, url=TEST_DOMAIN, timeout=PROBE_TIMEOUT, socks_host=SOCKS_HOST):
+    """Одна проверка через SOCKS5-порт. Возвращает словарь с этапами и ошибкой."""
+    result = new_result(port)
+    try:
+        await asyncio.wait_for(_probe(port, url, socks_host, result), timeout=timeout)
+    except asyncio.TimeoutError:
+        result["error"] = "timeout"
+    except Exception as e:
+        result["error"] = (str(e) or e.__class__.__name__)[:60]
+    return result
+
+
+async def probe_batch(ports, url=TEST_DOMAIN, timeout=PROBE_TIMEOUT, concurrency=PROBE_CONCURRENCY,
+                      deadline=None, on_result=None, socks_host=SOCKS_HOST):
+    """Проверяет порты параллельно; результаты — в порядке ports.
+
+    deadline — общий лимит на весь набор: кто не успел, отменяется с ошибкой
+    "batch deadline". on_result(result) вызывается по мере готовности каждого.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    results = [new_result(p) for p in ports]
+
+    async def one(i, port):
+        async with sem:
+            results[i] = await probe(port, url, timeout, socks_host)
+        if on_result:
+            on_result(results[i])
+
+    tasks = [asyncio.create_task(one(i, p)) for i, p in enumerate(ports)]
+    if not tasks:
+        return results
+    _, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+        for r in results:
+            if not r["ok"] and r["error"] is None:
+                r["error"] = "batch deadline"
+                if on_result:
+                    on_result(r)
+    return results
+
+
+async def probe_many(ports, url=TEST_DOMAIN, timeout=PROBE_TIMEOUT, concurrency=PROBE_CONCURRENCY,
+                     socks_host=SOCKS_HOST):
+    """Проверяет все порты в одном event loop; результаты — в порядке ports."""
+    return await probe_batch(ports, url, timeout, concurrency, socks_host=socks_host)
+
+
+def probe_port(port, url=TEST_DOMAIN, timeout=PROBE_TIMEOUT):
+    """Синхронная обёртка для кода на потоках: задержка в мс или None."""
+    result = asyncio.run(probe(port, url, timeout))
+    return result["latency"] if result["ok"] else None
@@ -0,0 +1,465 @@
+# =============================================================================
+# Параллельная загрузка источников подписок для коллектора
+# =============================================================================
+# Все источники качаются одновременно через один requests.Session с пулом
+# соединений. На каждый хост — ограничение числа одновременных запросов,
+# на всю загрузку — общий дедлайн. Тело ответа не держится в памяти целиком:
+# оно читается кусками, режется на строки и сразу фильтруется по vless://.
+# iter_fetch отдаёт источники по мере готовности, а не после последнего:
+# в памяти только строки источников, которые потребитель ещё не забрал.
+# SourceCache хранит между запусками валидаторы (ETag / Last-Modified) и хэш
+# тела в JSON, а отфильтрованные строки — отдельным файлом на источник:
+# скачанный источник сразу пишется туда, и строки (как и при ответе 304)
+# читаются с диска только тогда, когда до источника дошла очередь.
+# Источник может быть группой зеркал: качается один раз, с самого быстрого.
+# =============================================================================
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+FETCH_THREADS        = 64      # сколько источников качаем одновременно
+PER_HOST_CONNECTIONS = 8       # одновременных запросов к одному хосту
+CONNECT_TIMEOUT      = 10
+READ_TIMEOUT         = 20      # максимум тишины между кусками ответа
+GLOBAL_DEADLINE      = 180     # секунд на все источники вместе
+CHUNK_SIZE           = 64 * 1024
+USER_AGENT           = "Mozilla/5.0 (vless-collector)"
+CACHE_FILE           = os.path.join("cache", "sources.json")
+
+
+# ------------------------------- СЕССИЯ -------------------------------
+def make_session(per_host=PER_HOST_CONNECTIONS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=64, pool_maxsize=per_host, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+class HostLimiter:
+    """Семафор на каждый хост: не больше N одновременных запросов к нему."""
+
+    def __init__(self, limit=PER_HOST_CONNECTIONS):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._sems = {}
+
+    def get(self, url):
+        host = urlsplit(url).hostname or ""
+        with self._lock:
+            sem = self._sems.get(host)
+            if sem is None:
+                sem = self._sems[host] = threading.BoundedSemaphore(self.limit)
+            return sem
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# ------------------------------- КЭШ ИСТОЧНИКОВ -------------------------------
+class SourceCache:
+    """Кэш по URL на диске: в JSON — ETag, Last-Modified, sha256 тела и число
+    vless-строк; сами строки — в файле lines_path(url) рядом."""
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.lines_dir = os.path.splitext(path)[0]
+        self._lock = threading.Lock()
+        self.entries = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Кэш источников повреждён, начинаем заново: {e}")
+        for entry in self.entries.values():
+            entry.pop("lines", None)  # старый формат: строки лежали прямо в JSON
+
+    def lines_path(self, url):
+        name = hashlib.blake2b(url.encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.lines_dir, name + ".txt")
+
+    def get(self, url):
+        with self._lock:
+            return self.entries.get(url)
+
+    def put(self, url, resp, digest, lines, size):
+        """Запоминает валидаторы; lines=None — строки на диске уже те же, не переписываем."""
+        if lines is not None:
+            path = self.lines_path(url)
+            os.makedirs(self.lines_dir, exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for line in lines:
+                    f.write(line + "\n")
+            os.replace(tmp, path)
+        entry = {
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "sha256": digest,
+            "bytes": size,
+            "count": len(lines) if lines is not None else (self.get(url) or {}).get("count", 0),
+        }
+        with self._lock:
+            self.entries[url] = entry
+
+    def conditional_headers(self, url):
+        entry = self.get(url)
+        headers = {}
+        # без файла строк ответ 304 нечем было бы заполнить — качаем целиком
+        if entry and os.path.exists(self.lines_path(url)):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def save(self, keep_urls=None):
+        with self._lock:
+            entries = self.entries
+            if keep_urls is not None:
+                keep = set(keep_urls)
+                entries = {u: e for u, e in entries.items() if u in keep}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            if keep_urls is not None and os.path.isdir(self.lines_dir):
+                # файлы строк источников, которых больше нет в списке
+                wanted = {os.path.basename(self.lines_path(u)) for u in entries}
+                for name in os.listdir(self.lines_dir):
+                    if name.endswith(".txt") and name not in wanted:
+                        os.remove(os.path.join(self.lines_dir, name))
+
+
+# ------------------------------- ЧТЕНИЕ ОТВЕТА -------------------------------
+def iter_body_chunks(resp, stat, deadline=None, cancel=None, hasher=None):
+    """Куски тела ответа; байты считаются в stat["bytes"], дедлайн и отмена — на каждом куске."""
+    for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+        if deadline is not None and time.monotonic() > deadline:
+            raise DeadlineExceeded("общий дедлайн загрузки")
+        if cancel is not None and cancel.is_set():
+            raise DeadlineExceeded("загрузка отменена")
+        if not chunk:
+            continue
+        stat["bytes"] += len(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+        yield chunk
+
+
+def split_lines(chunks):
+    """Строки из потока кусков байт (строка может быть разрезана между кусками)."""
+    tail = b""
+    for chunk in chunks:
+        parts = (tail + chunk).split(b"\n")
+        tail = parts.pop()
+        for part in parts:
+            yield part.decode("utf-8", errors="ignore")
+    if tail:
+        yield tail.decode("utf-8", errors="ignore")
+
+
+def iter_body_lines(resp, stat, deadline=None, cancel=None, hasher=None):
+    """Построчно отдаёт тело ответа, считая байты в stat["bytes"]."""
+    return split_lines(iter_body_chunks(resp, stat, deadline, cancel, hasher))
+
+
+def iter_file_chunks(path):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def filter_vless(lines):
+    for line in lines:
+        line = line.strip()
+        if line.startswith("vless://"):
+            yield line
+
+
+def new_stat(url):
+    return {"url": url, "lines": [], "count": 0, "bytes": 0, "seconds": 0.0, "status": None,
+            "error": None, "cache": None, "saved_bytes": 0, "lines_path": None}
+
+
+def source_lines(stat):
+    """vless-строки источника: из памяти или, для ответа 304, из файла кэша."""
+    if stat["lines"] is not None:
+        yield from stat["lines"]
+    elif stat["lines_path"]:
+        with open(stat["lines_path"], "r", encoding="utf-8") as f:
+            yield from filter_vless(f)
+
+
+def fetch_source(session, url, limiter=None, deadline=None, cancel=None,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), cache=None):
+    """Качает один источник и возвращает статистику с найденными vless-строками.
+
+    stat["cache"]: "304" — сервер подтвердил, что ничего не менялось;
+    "same" — тело скачано, но хэш совпал с кэшем; "miss" — новое содержимое.
+    С кэшем тело сначала пишется во временный файл и хэшируется, а разбирается,
+    только если хэш не совпал: при "same" строки — уже готовые из кэша.
+    Строки в памяти не остаются: stat["lines"] = None, а читать их из
+    stat["lines_path"] (см. source_lines).
+    """
+    stat = new_stat(url)
+    start = time.monotonic()
+    sem = limiter.get(url) if limiter else None
+    try:
+        if sem is not None:
+            wait_for = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not sem.acquire(timeout=wait_for):
+                raise DeadlineExceeded("не дождались свободного соединения к хосту")
+        try:
+            if cancel is not None and cancel.is_set():
+                raise DeadlineExceeded("загрузка отменена")
+            headers = cache.conditional_headers(url) if cache else None
+            with session.get(url, timeout=timeout, stream=True, headers=headers) as resp:
+                stat["status"] = resp.status_code
+                entry = cache.get(url) if cache else None
+                if resp.status_code == 304 and entry:
+                    stat["cache"] = "304"
+                    stat["lines"] = None
+                    stat["lines_path"] = cache.lines_path(url)
+                    stat["count"] = entry.get("count", 0)
+                    stat["saved_bytes"] = entry.get("bytes", 0)
+                elif cache:
+                    resp.raise_for_status()
+                    fetch_cached_body(resp, stat, cache, entry, deadline, cancel)
+                else:
+                    resp.raise_for_status()
+                    stat["lines"].extend(filter_vless(iter_body_lines(resp, stat, deadline, cancel)))
+                    stat["count"] = len(stat["lines"])
+        finally:
+            if sem is not None:
+                sem.release()
+    except Exception as e:
+        stat["error"] = str(e)[:120] or e.__class__.__name__
+    stat["seconds"] = time.monotonic() - start
+    return stat
+
+
+def fetch_cached_body(resp, stat, cache, entry, deadline=None, cancel=None):
+    """Тело ответа при кэше: куски — во временный файл и в хэш; разбор — только
+    если хэш не совпал с прошлым запуском."""
+    path = cache.lines_path(stat["url"])
+    os.makedirs(cache.lines_dir, exist_ok=True)
+    spool = f"{path}.{threading.get_ident()}.body"
+    hasher = hashlib.sha256()
+    try:
+        with open(spool, "wb") as f:
+            for chunk in iter_body_chunks(resp, stat, deadline, cancel, hasher):
+                f.write(chunk)
+        digest = hasher.hexdigest()
+        if entry and entry.get("sha256") == digest and os.path.exists(path):
+            stat["cache"] = "same"
+            stat["count"] = entry.get("count", 0)
+            cache.put(stat["url"], resp, digest, None, stat["bytes"])
+        else:
+            stat["cache"] = "miss"
+            lines = list(filter_vless(split_lines(iter_file_chunks(spool))))
+            stat["count"] = len(lines)
+            cache.put(stat["url"], resp, digest, lines, stat["bytes"])
+    finally:
+        try:
+            os.remove(spool)
+        except OSError:
+            pass
+    # строки в файле кэша: пока источник ждёт очереди, память не держим
+    stat["lines"], stat["lines_path"] = None, path
+
+
+# ------------------------------- ЗЕРКАЛА -------------------------------
+# Группа берёт одно тело и отбрасывает остальные, поэтому склеиваются только
+# явно перечисленные наборы зеркал (mirror_sets: имя набора -> префиксы URL, за
+# которыми один и тот же путь) и translate.yandex-прокси адресов из них.
+# Всё остальное, даже похожее, качается как отдельный источник.
+
+
+def mirror_key(url, mirror_sets=None):
+    """Ключ логического источника: у зеркал одного файла из mirror_sets он совпадает;
+    None — URL ни в один набор не входит."""
+    parts = urlsplit(url)
+    if (parts.hostname or "").startswith("translate.yandex."):
+        inner = parse_qs(parts.query).get("url")
+        if inner:
+            return mirror_key(inner[0], mirror_sets)
+    for name, prefixes in (mirror_sets or {}).items():
+        for prefix in prefixes:
+            if url.startswith(prefix) and len(url) > len(prefix):
+                return name + "/" + url[len(prefix):]
+    return None
+
+
+def group_mirrors(urls, mirror_sets=None):
+    """Склеивает зеркала одного файла в кортежи на месте первого из них; URL вне
+    mirror_sets остаются как есть, по одному."""
+    sources = []
+    groups = {}
+    for url in urls:
+        key = mirror_key(url, mirror_sets)
+        if key is None:
+            sources.append([url])
+        elif key in groups:
+            if url not in groups[key]:
+                groups[key].append(url)
+        else:
+            groups[key] = [url]
+            sources.append(groups[key])
+    return [s[0] if len(s) == 1 else tuple(s) for s in sources]
+
+
+def source_mirrors(source):
+    """Источник — это URL или кортеж URL-зеркал одного и того же содержимого."""
+    return list(source) if isinstance(source, (list, tuple)) else [source]
+
+
+class MirrorGroup:
+    """Один логический источник на нескольких зеркалах.
+
+    Зеркала качаются параллельно; первое, отдавшее полное тело с vless-строками,
+    побеждает, остальные отменяются (выходят на следующем куске ответа).
+    """
+
+    def __init__(self, source, on_done=None):
+        self.mirrors = source_mirrors(source)
+        self.cancel = threading.Event()
+        self.results = [None] * len(self.mirrors)
+        self.winner = None
+        self.done = False
+        self.on_done = on_done  # вызывается один раз: есть победитель или отчитались все зеркала
+        self._lock = threading.Lock()
+
+    def finish(self, index, stat):
+        with self._lock:
+            self.results[index] = stat
+            if self.winner is None and not stat["error"] and stat["count"]:
+                self.winner = stat
+                self.cancel.set()
+            if self.done or (self.winner is None and None in self.results):
+                return
+            self.done = True
+        if self.on_done is not None:
+            self.on_done()
+
+    def result(self, deadline=None):
+        with self._lock:
+            done = [r for r in self.results if r is not None]
+            stat = self.winner or next((r for r in done if not r["error"]), None) or (done[0] if done else None)
+            if stat is None:
+                stat = new_stat(self.mirrors[0])
+                stat["error"] = "не уложился в общий дедлайн"
+                stat["seconds"] = float(deadline or 0)
+            if len(self.mirrors) > 1:
+                stat["mirrors"] = [
+                    (url, r["error"] if r else "не уложился в общий дедлайн")
+                    for url, r in zip(self.mirrors, self.results) if r is not stat
+                ]
+            return stat
+
+
+def fetch_mirror(group, index, session, limiter, deadline, timeout, cache):
+    stat = fetch_source(session, group.mirrors[index], limiter, deadline, group.cancel, timeout, cache)
+    group.finish(index, stat)
+
+
+# ------------------------------- ЗАГРУЗКА ВСЕХ -------------------------------
+def iter_fetch(sources, threads=FETCH_THREADS, per_host=PER_HOST_CONNECTIONS,
+               deadline=GLOBAL_DEADLINE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), session=None, cache=None):
+    """Качает все источники параллельно и отдаёт (номер в sources, статистика) по мере
+    готовности: источник выходит, как только у его группы зеркал есть победитель или
+    отчитались все зеркала. Не успевшие к дедлайну выходят последними с ошибкой.
+
+    Источник-кортеж считается группой зеркал (см. MirrorGroup).
+    Если передан cache, запросы идут условными GET, а кэш сохраняется на диск,
+    когда генератор закончился (или его закрыли).
+    """
+    own_session = session is None
+    session = session or make_session(per_host)
+    limiter = HostLimiter(per_host)
+    stop_at = time.monotonic() + deadline if deadline else None
+
+    ready = queue.Queue()
+    groups = [MirrorGroup(source, partial(ready.put, n)) for n, source in enumerate(sources)]
+    jobs = [(g, i) for g in groups for i in range(len(g.mirrors))]
+    executor = ThreadPoolExecutor(max_workers=max(1, min(threads, len(jobs))))
+    futures = [executor.submit(fetch_mirror, g, i, session, limiter, stop_at, timeout, cache) for g, i in jobs]
+    pending = set(range(len(groups)))
+    try:
+        while pending:
+            try:
+                n = ready.get(timeout=None if stop_at is None else max(0.0, stop_at - time.monotonic()))
+            except queue.Empty:
+                break
+            pending.discard(n)
+            yield n, groups[n].result(deadline)
+        # Всё, что не успело к дедлайну, бросаем: потоки сами выйдут на следующем куске
+        for g in groups:
+            g.cancel.set()
+        for n in sorted(pending):
+            yield n, groups[n].result(deadline)
+    finally:
+        for g in groups:
+            g.cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        if own_session and all(f.done() for f in futures):
+            session.close()
+        if cache is not None:
+            try:
+                cache.save(keep_urls=[url for g in groups for url in g.mirrors])
+            except Exception as e:
+                print(f"Не удалось сохранить кэш источников: {e}")
+
+
+def fetch_all(sources, threads=FETCH_THREADS, per_host=PER_HOST_CONNECTIONS,
+              deadline=GLOBAL_DEADLINE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), session=None, cache=None):
+    """То же, что iter_fetch, но списком в порядке sources и со строками в памяти у всех."""
+    results = [None] * len(sources)
+    for n, stat in iter_fetch(sources, threads, per_host, deadline, timeout, session, cache):
+        if stat["lines"] is None:
+            stat["lines"] = list(source_lines(stat))
+        results[n] = stat
+    return results
+
+
+def print_fetch_report(results):
+    total_bytes = sum(r["bytes"] for r in results)
+    total_lines = sum(r["count"] for r in results)
+    print(f"\n{'Сек':>6} {'КБ':>9} {'vless':>7}  Источник")
+    for r in sorted(results, key=lambda x: -x["seconds"]):
+        mark = f"  [{r['error']}]" if r["error"] else (f"  [{r['cache']}]" if r["cache"] else "")
+        print(f"{r['seconds']:>6.1f} {r['bytes'] / 1024:>9.1f} {r['count']:>7}  {r['url']}{mark}")
+        for url, error in r.get("mirrors", ()):
+            print(f"{'':>25}  зеркало {url}  [{error or 'не понадобилось'}]")
+    print(f"Итого: {total_bytes / 1024 / 1024:.1f} МБ, {total_lines} vless-строк из {len(results)} источников")
+
+    counts = {"304": 0, "same": 0, "miss": 0}
+    for r in results:
+        if r["cache"] in counts:
+            counts[r["cache"]] += 1
+    if any(counts.values()):
+        saved = sum(r["saved_bytes"] for r in results)
+        unparsed = sum(r["bytes"] for r in results if r["cache"] == "same")
+        print(f"Кэш источников: 304 — {counts['304']}, без изменений — {counts['same']}, "
+              f"обновлено — {counts['miss']}; не скачано {saved / 1024 / 1024:.1f} МБ (ответы 304), "
+              f"скачано, но не разобрано {unparsed / 1024 / 1024:.1f} МБ (хэш совпал)")
+    print()
@@ -0,0 +1,66 @@
+# Дедупликация живых прокси через хэшируемые ключи: dedup_identity склеивает
+# ровно те пары, что и попарный compare_parsed, а обе дедупликации дают тот же
+# вывод, что прежние O(n²) версии.
+
+import itertools
+
+import pytest
+
+from benchmarks import dedup_fixtures, legacy_deduplicate_proxies, legacy_work_test_deduplicate
+from Uidd_gen_work import compare_parsed, dedup_identity, deduplicate_proxies, parse_vless
+from work_test import compare_proxies, deduplicate
+from work_test import parse_vless as work_test_parse
+
+BASE = {"protocol": "vless", "address": "1.2.3.4", "port": 443, "uuid": "u", "encryption": "none",
+        "type": "tcp", "headerType": "none", "host": "", "path": "", "security": "reality",
+        "flow": "", "sni": "a.example", "alpn": [], "fp": "chrome", "pbk": "k", "sid": ""}
+
+
+@pytest.fixture(scope="module")
+def items():
+    return dedup_fixtures(40)
+
+
+def same(a, b):
+    return dedup_identity(a) == dedup_identity(b)
+
+
+@pytest.mark.parametrize("change, glued", [
+    ({"host": "cdn.example.com"}, True),     # host игнорируется, как в v2rayN
+    ({"tag": "другой тег"}, True),
+    ({"sid": None}, True),                   # "", None и [] — одно и то же пустое
+    ({"alpn": None}, True),
+    ({"path": []}, True),
+    ({"port": "443"}, False),                # port сравнивается как есть
+    ({"alpn": ["h2"]}, False),
+    ({"sni": "b.example"}, False),
+    ({"uuid": "U"}, False),
+])
+def test_identity_follows_compare_parsed(change, glued):
+    other = dict(BASE, **change)
+    assert compare_parsed(BASE, other) is glued
+    assert same(BASE, other) is glued
+
+
+def test_alpn_order_matters_in_both():
+    a, b = dict(BASE, alpn=["h2", "http/1.1"]), dict(BASE, alpn=["http/1.1", "h2"])
+    assert not compare_parsed(a, b) and not same(a, b)
+
+
+def test_identity_agrees_with_compare_parsed_on_corpus_pairs(items):
+    parsed = [p for p in (parse_vless(url) for url, _ in items) if p]
+    for a, b in itertools.combinations(parsed, 2):
+        assert same(a, b) == compare_parsed(a, b), (a, b)
+
+
+def test_deduplicate_proxies_matches_pairwise_version(items):
+    keep, removed = deduplicate_proxies(items)
+    assert (keep, removed) == legacy_deduplicate_proxies(items)
+    assert removed and len(keep) + removed == len(items)
+
+
+def test_work_test_deduplicate_matches_pairwise_version(items):
+    unique = deduplicate(items)
+    assert unique == legacy_work_test_deduplicate(items)
+    parsed = [work_test_parse(url) for url, _ in unique]
+    assert not any(compare_proxies(a, b) for a, b in itertools.combinations(parsed, 2))
@@ -0,0 +1,109 @@
+# Резолв имён коллектора (dns_resolve.py): ответы, негативный кэш, сроки записей.
+# Без сети: резолвер-заглушка или локальный DNS-сервер на dnspython.
+
+import asyncio
+import time
+
+import pytest
+
+from benchmarks import DnsStubServer, stub_answer
+from dns_resolve import (MAX_TTL, NEGATIVE_TTL, POSITIVE_TTL, BatchResolver, DnsCache,
+                         make_dnspython_resolver, resolve_hosts)
+
+HOSTS = [f"srv{i % 40}.example.net" for i in range(200)]
+
+
+def counting_resolver(answers=stub_answer, ttl=None):
+    """Резолвер-заглушка: считает обращения по именам; ttl — отдавать пару (ip, TTL)."""
+    async def resolve(host):
+        resolve.calls.append(host)
+        await asyncio.sleep(0)
+        ip = answers(host)
+        return (ip, ttl) if ttl is not None else ip
+
+    resolve.calls = []
+    return resolve
+
+
+def test_answers_match_direct_lookup_and_each_name_resolved_once():
+    resolver = counting_resolver()
+    result, stats = resolve_hosts(HOSTS, DnsCache(None), resolver)
+    assert result == {h: stub_answer(h) for h in HOSTS}
+    assert sorted(resolver.calls) == sorted(set(HOSTS))
+    assert stats["hosts"] == 40 and stats["resolved"] + stats["nxdomain"] == 40
+
+
+def test_negative_answers_come_from_cache():
+    cache = DnsCache(None)
+    nx = lambda host: None if host.startswith("nx") else "10.0.0.1"
+    hosts = ["nx1.test", "nx2.test", "ok.test"]
+    first, stats = resolve_hosts(hosts, cache, counting_resolver(nx))
+    assert first == {"nx1.test": None, "nx2.test": None, "ok.test": "10.0.0.1"} and stats["nxdomain"] == 2
+
+    again = counting_resolver(nx)
+    second, stats = resolve_hosts(hosts, cache, again)
+    assert second == first and again.calls == [] and stats["cached"] == 3
+
+
+def test_failures_are_not_cached():
+    async def broken(host):
+        raise OSError("сервер не отвечает")
+
+    cache = DnsCache(None)
+    result, stats = resolve_hosts(["a.test"], cache, broken)
+    assert result == {"a.test": None} and stats["failed"] == 1
+    assert cache.get("a.test") == (False, None)
+
+
+def test_cache_entries_expire():
+    cache = DnsCache(None)
+    cache.put("a.test", "10.0.0.1", now=1000)
+    cache.put("nx.test", None, now=1000)
+    cache.put("short.test", "10.0.0.2", ttl=30, now=1000)
+    cache.put("long.test", "10.0.0.3", ttl=7 * 86400, now=1000)
+
+    assert cache.get("a.test", now=1000 + POSITIVE_TTL - 1) == (True, "10.0.0.1")
+    assert cache.get("a.test", now=1000 + POSITIVE_TTL + 1) == (False, None)
+    assert cache.get("nx.test", now=1000 + NEGATIVE_TTL - 1) == (True, None)
+    assert cache.get("nx.test", now=1000 + NEGATIVE_TTL + 1) == (False, None)
+    assert cache.get("short.test", now=1031) == (False, None)
+    assert cache.entries["long.test"][1] == 1000 + MAX_TTL
+
+
+def test_cache_file_keeps_only_live_entries(tmp_path):
+    path = str(tmp_path / "dns.json")
+    cache = DnsCache(path)
+    cache.put("live.test", "10.0.0.1")
+    cache.put("old.test", "10.0.0.2", ttl=10, now=1000)
+    cache.save()
+    assert DnsCache(path).entries == {"live.test": cache.entries["live.test"]}
+
+
+def test_batch_resolver_shares_cache_between_batches():
+    resolver = counting_resolver(ttl=300)
+    with BatchResolver(DnsCache(None), resolver) as batches:
+        first, _ = batches.resolve(HOSTS[:100])
+        second, stats = batches.resolve(HOSTS[100:])
+    assert first == {h: stub_answer(h) for h in HOSTS[:100]}
+    assert second == {h: stub_answer(h) for h in HOSTS[100:]}
+    assert sorted(resolver.calls) == sorted(set(HOSTS)) and stats["cached"] == 40
+
+
+def test_ttl_from_dns_answers():
+    pytest.importorskip("dns")
+    records = {
+        "a.test": ("A", "10.0.0.1", 120),
+        "alias.test": ("CNAME", "a.test", 30),        # срок — минимум по цепочке
+        "week.test": ("A", "10.0.0.2", 7 * 86400),    # обрезается до MAX_TTL
+    }
+    expected = {"a.test": 120, "alias.test": 30, "week.test": MAX_TTL, "nx.test": 90}
+    with DnsStubServer(records, soa_ttl=600, soa_minimum=90) as server:
+        cache = DnsCache(None)
+        now = time.time()
+        result, stats = resolve_hosts(list(expected), cache, make_dnspython_resolver(["127.0.0.1"], server.port))
+
+    assert result == {"a.test": "10.0.0.1", "alias.test": "10.0.0.1", "week.test": "10.0.0.2", "nx.test": None}
+    assert stats["resolved"] == 3 and stats["nxdomain"] == 1
+    # NXDOMAIN живёт SOA minimum, а не фиксированный NEGATIVE_TTL
+    ttls = {host: round(cache.entries[host][1] - now) for host in expected}
+    assert all(abs(ttls[h] - ttl) <= 2 for h, ttl in expected.items()), ttls
@@ -0,0 +1,115 @@
+# Пул портов для inbound'ов xray (port_pool.py). Занятость портов задаётся
+# подменой check, поэтому тесты не зависят от того, что ещё слушает машина;
+# настоящий bind проверяется один раз на сокете самого теста.
+
+import socket
+import subprocess
+import threading
+import time
+
+import pytest
+
+import port_pool
+from port_pool import PortPool
+
+
+class FakeProc:
+    """Вместо xray: wait() либо сразу возвращается, либо «процесс не выходит»."""
+
+    def __init__(self, exits=True):
+        self.exits = exits
+        self.waited = False
+
+    def wait(self, timeout=None):
+        self.waited = True
+        if not self.exits:
+            raise subprocess.TimeoutExpired("xray", timeout)
+        return 0
+
+
+def test_foreign_ports_are_skipped():
+    busy = {1003, 1017}
+    pool = PortPool(1000, 1040, cooldown=0, check=lambda port: port not in busy)
+    leases = [pool.acquire(10), pool.acquire(10)]
+    taken = {p for lease in leases for p in lease.ports}
+    assert not taken & busy and len(taken) == 20
+    assert all(list(l.ports) == list(range(l.start, l.start + 10)) for l in leases)
+    assert pool.foreign == 2
+
+
+def test_concurrent_leases_never_overlap():
+    pool = PortPool(1000, 1300, cooldown=0, check=lambda port: True)
+    live = set()
+    lock = threading.Lock()
+    errors = []
+
+    def worker():
+        for _ in range(50):
+            lease = pool.acquire(20)
+            with lock:
+                if live & set(lease.ports):
+                    errors.append(lease.start)
+                live.update(lease.ports)
+            time.sleep(0.001)
+            with lock:
+                live.difference_update(lease.ports)
+            lease.release()
+
+    threads = [threading.Thread(target=worker) for _ in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors and pool.in_use == 0 and pool.acquired == 600
+
+
+def test_released_range_is_quarantined():
+    pool = PortPool(1000, 1020, cooldown=0.2, check=lambda port: True)
+    first = pool.acquire(10)
+    first.release()
+    second = pool.acquire(10)           # свежий диапазон, а не только что освобождённый
+    assert second.start != first.start
+    second.release()
+    with pytest.raises(TimeoutError):   # оба в карантине
+        pool.acquire(10, timeout=0.05)
+    time.sleep(0.25)
+    assert pool.acquire(10, timeout=1).start in (1000, 1010)
+
+
+def test_range_does_not_wrap_past_the_end():
+    pool = PortPool(1000, 1025, cooldown=0, check=lambda port: True)
+    pool.acquire(10)
+    pool.acquire(10)
+    with pytest.raises(TimeoutError):   # хвост из 5 портов не склеивается с началом
+        pool.acquire(10, timeout=0.05)
+    with pytest.raises(ValueError):
+        pool.acquire(30)
+
+
+def test_release_waits_for_xray_exit(monkeypatch):
+    monkeypatch.setattr(port_pool, "EXIT_WAIT", 0.01)
+    pool = PortPool(1000, 1010, cooldown=0, check=lambda port: True)
+    proc = FakeProc()
+    lease = pool.acquire(10)
+    lease.release(proc)
+    assert proc.waited and pool.in_use == 0
+    lease.release(proc)                 # повторный release ничего не делает
+    assert pool.in_use == 0
+
+    stuck = pool.acquire(10)
+    stuck.release(FakeProc(exits=False))
+    # xray не вышел: порты за ним так и остаются
+    assert pool.leaked == 1 and pool.in_use == 10
+    with pytest.raises(TimeoutError):
+        pool.acquire(10, timeout=0.05)
+
+
+def test_real_listener_is_not_leased():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        s.listen(1)
+        port = s.getsockname()[1]
+        pool = PortPool(port - 4, port + 5, cooldown=0)
+        lease = pool.acquire(4)
+        assert port not in lease.ports
+        lease.release()
@@ -0,0 +1,126 @@
+# asyncio-пробер (socks_probe.py): успешная проверка и все пути ошибок —
+# закрытый порт, отказ SOCKS, зависший туннель, не-204 и не-HTTP ответ,
+# дедлайн батча. Локальные заглушки вместо xray и generate_204.
+
+import asyncio
+import socket
+import socketserver
+import threading
+
+import pytest
+
+from benchmarks import FixtureServer, Http204Server, Socks5StandIn
+from results_store import classify_error
+from socks_probe import SOCKS_REPLIES, probe_batch, probe_many
+
+URL = "http://probe.test/generate_204"   # имя «резолвит» заглушка SOCKS
+
+
+class ScriptedSocks:
+    """SOCKS5-сервер с заданным ответом: method — выбранный метод авторизации,
+    rep — код ответа на CONNECT, after — байты вместо HTTP-ответа после туннеля."""
+
+    def __init__(self, method=0, rep=0, after=b""):
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                conn = self.request
+                conn.recv(3)
+                conn.sendall(bytes([5, method]))
+                if method != 0:
+                    return
+                conn.recv(512)
+                conn.sendall(bytes([5, rep, 0, 1]) + bytes(6))
+                if rep == 0:
+                    conn.recv(512)
+                    conn.sendall(after)
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run(ports, url=URL, timeout=5.0, **kwargs):
+    return asyncio.run(probe_many(ports, url, timeout=timeout, **kwargs))
+
+
+def test_live_port_reports_stages():
+    with Http204Server() as http, Socks5StandIn(("127.0.0.1", int(http.base.rsplit(":", 1)[1]))) as socks:
+        [r] = run(socks.ports)
+    assert r["ok"] and r["status"] == 204 and r["error"] is None
+    assert r["latency"] is not None and r["connect_ms"] is not None and r["first_byte_ms"] is not None
+    assert r["tls_ms"] is None   # http:// — без TLS
+
+
+def test_closed_port_is_refused():
+    [r] = run([closed_port()])
+    assert not r["ok"] and r["latency"] is None and classify_error(r["error"]) == "refused"
+
+
+@pytest.mark.parametrize("rep", sorted(SOCKS_REPLIES))
+def test_socks_reply_codes(rep):
+    with ScriptedSocks(rep=rep) as socks:
+        [r] = run([socks.port])
+    assert not r["ok"] and r["error"] == SOCKS_REPLIES[rep] and classify_error(r["error"]) == "socks"
+
+
+def test_socks_auth_method_rejected():
+    with ScriptedSocks(method=0xFF) as socks:
+        [r] = run([socks.port])
+    assert not r["ok"] and classify_error(r["error"]) == "socks"
+
+
+def test_hung_tunnel_times_out():
+    with Socks5StandIn(None) as hung:
+        [r] = run(hung.ports, timeout=0.5)
+    assert not r["ok"] and r["error"] == "timeout" and r["latency"] is None
+
+
+def test_non_204_status_is_an_error(tmp_path):
+    with FixtureServer(str(tmp_path)) as http, \
+            Socks5StandIn(("127.0.0.1", int(http.base.rsplit(":", 1)[1]))) as socks:
+        [r] = run(socks.ports, url="http://probe.test/")
+    assert not r["ok"] and r["status"] == 200 and r["error"] == "HTTP 200"
+    assert classify_error(r["error"]) == "http"
+
+
+@pytest.mark.parametrize("reply", [b"", b"SSH-2.0-OpenSSH\r\n"])
+def test_empty_or_non_http_reply(reply):
+    with ScriptedSocks(after=reply) as socks:
+        [r] = run([socks.port])
+    assert not r["ok"] and r["status"] is None and r["error"]
+
+
+def test_results_keep_port_order():
+    with Http204Server() as http, \
+            Socks5StandIn(("127.0.0.1", int(http.base.rsplit(":", 1)[1])), ports=3) as live, \
+            ScriptedSocks(rep=5) as refused:
+        ports = [live.ports[0], refused.port, closed_port(), live.ports[1], live.ports[2]]
+        results = run(ports, concurrency=2)
+    assert [r["port"] for r in results] == ports
+    assert [r["ok"] for r in results] == [True, False, False, True, True]
+
+
+def test_batch_deadline_cuts_hung_ports():
+    seen = []
+    with Http204Server() as http, \
+            Socks5StandIn(("127.0.0.1", int(http.base.rsplit(":", 1)[1])), ports=2) as live, \
+            Socks5StandIn(None, ports=2) as hung:
+        ports = live.ports + hung.ports
+        results = asyncio.run(probe_batch(ports, URL, timeout=30, deadline=1.0, on_result=seen.append))
+    assert [r["ok"] for r in results] == [True, True, False, False]
+    assert [r["error"] for r in results[2:]] == ["batch deadline", "batch deadline"]
+    assert sorted(r["port"] for r in seen) == sorted(ports)
@@ -0,0 +1,103 @@
+# Параллельная загрузка источников (source_fetch.py) против прежнего цикла
+# requests.get на локальном сервере с фикстурами, без сети.
+
+from benchmarks import FixtureServer, legacy_fetch
+from source_fetch import CHUNK_SIZE, SourceCache, fetch_all
+
+VLESS = "vless://11111111-2222-3333-4444-555555555555@10.0.0.{}:443?security=none#{}"
+
+
+def write_sources(directory):
+    """Файлы-источники с неудобными местами: CRLF, мусор, строки длиннее куска чтения."""
+    bodies = {
+        "plain.txt": "\n".join(VLESS.format(i, i) for i in range(50)) + "\n",
+        "crlf.txt": "\r\n".join(["# заголовок", *(VLESS.format(i, "crlf") for i in range(20))]),
+        "long.txt": "\n".join(VLESS.format(i, "x" * CHUNK_SIZE) for i in range(3)),
+        "spaces.txt": "  " + VLESS.format(1, "a") + "  \n\nvmess://abc\n" + VLESS.format(2, "b"),
+        "empty.txt": "",
+    }
+    for name, body in bodies.items():
+        (directory / name).write_bytes(body.encode("utf-8"))
+    return list(bodies)
+
+
+def test_fetch_all_matches_sequential_get(tmp_path):
+    names = write_sources(tmp_path)
+    with FixtureServer(str(tmp_path)) as server:
+        urls = [f"{server.base}/{n}" for n in names] + [f"{server.base}/missing.txt"]
+        legacy = legacy_fetch(urls)
+        results = fetch_all(urls, threads=4, per_host=2)
+
+    assert [l for r in results for l in r["lines"]] == legacy
+    assert [r["url"] for r in results] == urls
+    assert results[-1]["error"] and results[-1]["lines"] == []
+    assert all(r["error"] is None for r in results[:-1])
+    assert [r["count"] for r in results[:-1]] == [50, 20, 3, 2, 0]
+
+
+def test_mirror_group_takes_first_complete_body(tmp_path):
+    names = write_sources(tmp_path)
+    with FixtureServer(str(tmp_path)) as server:
+        good = f"{server.base}/{names[0]}"
+        missing, empty = f"{server.base}/missing.txt", f"{server.base}/empty.txt"
+        [grouped] = fetch_all([(missing, empty, good)], threads=4)
+        [alone] = fetch_all([good])
+
+    # Ошибка и пустое тело не выигрывают: побеждает зеркало с vless-строками
+    assert grouped["url"] == good and grouped["lines"] == alone["lines"]
+    losers = dict(grouped["mirrors"])
+    assert set(losers) == {missing, empty} and losers[missing]
+
+
+def test_mirror_group_without_lines_reports_error(tmp_path):
+    with FixtureServer(str(tmp_path)) as server:
+        [res] = fetch_all([(f"{server.base}/a.txt", f"{server.base}/b.txt")])
+    assert res["error"] and res["lines"] == [] and len(res["mirrors"]) == 1
+
+
+def fetch_twice(tmp_path, validators, change=None):
+    """Два запуска с одним кэшем; change(directory) — правка источников между ними."""
+    sources = tmp_path / "src"
+    sources.mkdir()
+    names = write_sources(sources)
+    cache_path = str(tmp_path / "cache" / "sources.json")
+    with FixtureServer(str(sources), validators=validators) as server:
+        urls = [f"{server.base}/{n}" for n in names]
+        first = fetch_all(urls, cache=SourceCache(cache_path))
+        if change:
+            change(sources)
+        second = fetch_all(urls, cache=SourceCache(cache_path))
+        fresh = fetch_all(urls)
+    return first, second, fresh
+
+
+def test_cache_answers_304_with_cached_lines(tmp_path):
+    first, second, fresh = fetch_twice(tmp_path, validators=True)
+    assert {r["cache"] for r in first} == {"miss"}
+    assert {r["cache"] for r in second} == {"304"}
+    assert [r["lines"] for r in second] == [r["lines"] for r in fresh]
+    assert [r["count"] for r in second] == [r["count"] for r in fresh]
+
+
+def test_cache_same_hash_skips_parse(tmp_path, monkeypatch):
+    import source_fetch
+
+    parsed = []
+    split_lines = source_fetch.split_lines
+    monkeypatch.setattr(source_fetch, "split_lines", lambda chunks: parsed.append(1) or split_lines(chunks))
+    first, second, fresh = fetch_twice(tmp_path, validators=False)
+    assert {r["cache"] for r in second} == {"same"}
+    assert [r["lines"] for r in second] == [r["lines"] for r in fresh] == [r["lines"] for r in first]
+    # тело разбирают первый запуск и запуск без кэша; второй берёт строки из кэша
+    assert len(parsed) == 2 * len(fresh)
+    assert not any(p.name.endswith(".body") for p in (tmp_path / "cache").rglob("*"))
+
+
+def test_cache_picks_up_changed_body(tmp_path):
+    def change(directory):
+        (directory / "plain.txt").write_text(VLESS.format(99, "new") + "\n", encoding="utf-8")
+
+    _, second, fresh = fetch_twice(tmp_path, validators=False, change=change)
+    assert [r["cache"] for r in second] == ["miss", "same", "same", "same", "same"]
+    assert second[0]["lines"] == [VLESS.format(99, "new")]
+    assert [r["lines"] for r in second] == [r["lines"] for r in fresh]
@@ -0,0 +1,148 @@
+# =============================================================================
+# Общий разбор vless:// для всех скриптов
+# =============================================================================
+# Раньше у каждого скрипта был свой парсер, и одна и та же строка за запуск
+# проходила через urlparse/parse_qs по нескольку раз (генерация, дедупликация,
+# конфиг xray, печать таблицы). Здесь разбор делается один раз: parse() кладёт
+# результат в LRU-кэш по очищенной строке и возвращает компактную запись
+# VlessRecord с «сырыми» полями. Нормализацию под свои нужды (flow, security,
+# ключи сравнения) скрипты делают поверх записи — это уже без urllib.
+# Общее для обоих чекеров правило «что примет xray» — xray_fields().
+#
+# Для коллектора здесь же лежат быстрые строковые помощники без urlparse
+# (хост и ключ дедупликации). Их не кэшируем: коллектор видит каждую строку
+# один раз, а кэш на сотни тысяч строк только съел бы память.
+# =============================================================================
+
+import re
+import urllib.parse
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+PARSE_CACHE_SIZE = 1 << 16     # записей в LRU-кэше parse()
+DEFAULT_PORT     = 443
+
+
+def clean_url(url):
+    return url.strip().replace('\ufeff', '').replace('\u200b', '').replace('\n', '').replace('\r', '')
+
+
+class VlessRecord(NamedTuple):
+    """Разобранная vless-ссылка. Запись общая для всех, кто попал в кэш: не менять."""
+    main: str              # ссылка без #фрагмента
+    uuid: str              # как в ссылке, после unquote (регистр не трогаем)
+    address: str           # hostname из urlsplit: в нижнем регистре, без [] у IPv6
+    port: int
+    params: dict           # параметр -> первое значение без пробелов по краям; пустые опущены
+    tag: Optional[str]     # раскодированный фрагмент; None — фрагмента нет
+
+    def param(self, key, default=""):
+        return self.params.get(key, default)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_clean(url):
+    if not url.startswith("vless://"):
+        return None
+    main, has_tag, tag_raw = url.partition('#')
+    try:
+        parts = urllib.parse.urlsplit(main)
+        port = parts.port or DEFAULT_PORT
+        query = urllib.parse.parse_qs(parts.query)
+    except Exception:
+        return None
+    return VlessRecord(
+        main=main,
+        uuid=urllib.parse.unquote(parts.username or ""),
+        address=parts.hostname or "",
+        port=port,
+        params={k: v[0].strip() for k, v in query.items()},
+        tag=urllib.parse.unquote(tag_raw).strip() if has_tag else None,
+    )
+
+
+def parse(url):
+    """VlessRecord или None, если это не vless:// или ссылка не разбирается."""
+    return _parse_clean(clean_url(url))
+
+
+def parse_many(urls):
+    """Пакетный разбор: записи в порядке urls, повторы берутся из кэша."""
+    return [_parse_clean(clean_url(u)) for u in urls]
+
+
+# ------------------------------- ПОЛЯ ДЛЯ XRAY -------------------------------
+# С чем xray не стартует, одна такая ссылка роняет весь батч. Поля приводятся
+# к тому, что xray примет (неизвестный flow — пустой, из sid выкидывается
+# всё, кроме hex); отбрасывается только то, что так не чинится.
+REALITY_PBK_RE  = re.compile(r"^[A-Za-z0-9_-]{43,44}$")
+XRAY_SECURITIES = ("none", "tls", "reality")
+XRAY_FLOWS      = ("", "xtls-rprx-vision", "xtls-rprx-vision-udp443")   # direct/splice из xray убраны
+XRAY_SID_MAX    = 16                                                    # shortId — до 8 байт в hex
+
+
+class XrayFields(NamedTuple):
+    flow: str
+    security: str
+    pbk: str
+    sid: str
+
+
+def xray_fields(rec):
+    """flow, security, pbk, sid записи в виде, который примет xray; None — не примет
+    никак (reality без правильного publicKey)."""
+    flow = rec.param("flow").lower()
+    if flow not in XRAY_FLOWS:
+        flow = ""
+    security = rec.param("security", "none").lower()
+    if security not in XRAY_SECURITIES:
+        security = "none"
+    pbk = rec.param("pbk")
+    if not REALITY_PBK_RE.match(pbk):
+        pbk = ""
+    sid = re.sub(r"[^a-fA-F0-9]", "", rec.param("sid"))
+    if len(sid) % 2 or len(sid) > XRAY_SID_MAX:
+        sid = ""
+    if security == "reality" and not pbk:
+        return None
+    return XrayFields(flow, security, pbk, sid)
+
+
+def cache_info():
+    return _parse_clean.cache_info()
+
+
+def clear_cache():
+    _parse_clean.cache_clear()
+
+
+# ------------------------------- БЫСТРЫЕ ПОМОЩНИКИ КОЛЛЕКТОРА -------------------------------
+HOST_RE = re.compile(r'@([^:]+):')
+
+
+def extract_host_from_vless(vless_url):
+    match = HOST_RE.search(vless_url)
+    return match.group(1).strip() if match else None
+
+
+def get_dedup_key(vless_url):
+    """Возвращает ключ для дедупликации: всё кроме #комментария и параметра fp"""
+    # Убираем фрагмент после #
+    url_no_fragment = vless_url.split('#', 1)[0].strip()
+
+    # Если нет параметров — возвращаем как есть
+    if '?' not in url_no_fragment:
+        return url_no_fragment
+
+    base, params_str = url_no_fragment.split('?', 1)
+
+    # Разбиваем параметры, убираем fp=..., remark=... и пустые; сортируем,
+    # чтобы порядок параметров не влиял
+    filtered = sorted(p for p in params_str.split('&')
+                      if p and not p.startswith('fp=') and not p.startswith('remark='))
+
+    if filtered:
+        return f"{base}?{'&'.join(filtered)}"
+    else:
+        return base
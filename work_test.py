@@ -5,88 +5,104 @@ import shutil
 import time
 import socket
 import subprocess
-import requests
-import re
 import json
 import urllib.parse
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import urllib3
+import asyncio
+from collections import Counter
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from Uidd_gen_work import create_batch_config_file
+from adaptive_timeout import AdaptiveTimeout
+from port_pool import PORT_LAST, PortPool
+from reach_probe import StageStats, count_endpoints, prefilter
+from results_store import ResultsStore, ResultsWriter, classify_error
+from retest_schedule import QUICK_TIMEOUT, load_histories, plan_retests
+from shard_pool import run_sharded, shard_count
+from socks_probe import probe_many, probe_port as socks_probe_port
+from vless_parse import clean_url, parse as parse_record, xray_fields
+import xray_ready
 
 # ------------------------------- НАСТРОЙКИ -------------------------------
 INPUT_FILE = "sidr_vless.txt"
 OUTPUT_FILE = "sidr_vless_work.txt"
 TEST_DOMAIN = "https://www.google.com/generate_204"
-TIMEOUT_HTTP = 60  
-CORE_STARTUP_TIMEOUT = 20.0  
+TIMEOUT_HTTP = 60        # потолок; рабочий таймаут подстраивается по задержкам живых (adaptive_timeout.py)
+CORE_STARTUP_TIMEOUT = 20.0  # то же для старта xray
+MIN_TIMEOUT_HTTP = 5.0
+MIN_STARTUP_TIMEOUT = 2.0
 THREADS = 500
+BATCH_MODE = True        # один xray на батч прокси вместо процесса на каждую
+BATCH_SIZE = 100         # прокси (inbound'ов) в одном xray
+LOCAL_PORT_START = 10000  # начало пула портов inbound'ов (port_pool.py)
+SHARDS = 0               # процессов проверки (shard_pool.py): 0 — по числу ядер, 1 — всё в этом процессе
 processed_count = 0
 total_proxies_count = 0
 
 counter_lock = threading.Lock()
 print_lock = threading.Lock()
+store_writer = None  # ResultsWriter запуска: каждая проверка уходит в cache/probes.db
+xray_errors = Counter()  # классы ошибок полной проверки для сводки воронки
+http_timeout = AdaptiveTimeout("проверка", TIMEOUT_HTTP, MIN_TIMEOUT_HTTP)
+startup_timeout = AdaptiveTimeout("старт xray", CORE_STARTUP_TIMEOUT, MIN_STARTUP_TIMEOUT)
+port_pool = PortPool(LOCAL_PORT_START)  # проверенные свободные порты, возврат после выхода xray
+shard_summaries = []  # сводки таймаутов/xray/портов от шардов
 
 # ------------------------------- ПОМОЩНИКИ -------------------------------
-def clean_url(url):
-    return url.strip().replace('\ufeff', '').replace('\u200b', '').replace('\n', '').replace('\r', '')
-
 def parse_vless(url):
-    try:
-        url = clean_url(url)
-        if not url.startswith("vless://"): return None
-        main_part = url.split('#')[0]
-        parsed_url = urllib.parse.urlparse(main_part)
-        query_params = urllib.parse.parse_qs(parsed_url.query)
-        def get_p(key, default=""): return query_params.get(key, [default])[0].strip()
-
-        net_type = get_p("type", "tcp").lower()
-        if net_type in ["ws", "websocket"]: net_type = "ws"
-        elif net_type in ["grpc", "gun"]: net_type = "grpc"
-        elif net_type in ["http", "h2", "httpupgrade"]: net_type = "http"
-        else: net_type = "tcp"
-
-        return {
-            "uuid": urllib.parse.unquote(parsed_url.username or ""),
-            "address": parsed_url.hostname or "",
-            "port": parsed_url.port or 443,
-            "flow": get_p("flow").lower() if get_p("flow") in ["xtls-rprx-vision", "xtls-rprx-direct"] else "",
-            "security": get_p("security", "none").lower(),
-            "pbk": get_p("pbk"),
-            "sid": re.sub(r"[^a-fA-F0-9]", "", get_p("sid")),
-            "sni": get_p("sni") or parsed_url.hostname,
-            "fp": get_p("fp") or "chrome",
-            "alpn": [x.strip() for x in get_p("alpn").split(",")] if get_p("alpn") else [],
-            "type": net_type,
-            "host": get_p("host"),
-            "path": urllib.parse.unquote(get_p("path")),
-            "serviceName": get_p("serviceName"),
-            "headerType": get_p("headerType", "none"),
-        }
-    except: return None
+    """Поля для конфига xray или None — ссылка не разбирается или xray её не примет
+    (правило общее с Uidd_gen_work: vless_parse.xray_fields)."""
+    rec = parse_record(url)  # общий кэшированный разбор, см. vless_parse.py
+    if rec is None: return None
+    get_p = rec.param
+
+    fields = xray_fields(rec)
+    if fields is None: return None
+    flow, security, pbk, sid = fields
+
+    net_type = get_p("type", "tcp").lower()
+    if net_type in ["ws", "websocket"]: net_type = "ws"
+    elif net_type in ["grpc", "gun"]: net_type = "grpc"
+    elif net_type in ["http", "h2", "httpupgrade"]: net_type = "http"
+    else: net_type = "tcp"
+
+    return {
+        "uuid": rec.uuid,
+        "address": rec.address,
+        "port": rec.port,
+        "flow": flow,
+        "security": security,
+        "pbk": pbk,
+        "sid": sid,
+        "sni": get_p("sni") or rec.address,
+        "fp": get_p("fp") or "chrome",
+        "alpn": [x.strip() for x in get_p("alpn").split(",")] if get_p("alpn") else [],
+        "type": net_type,
+        "host": get_p("host"),
+        "path": urllib.parse.unquote(get_p("path")),
+        "serviceName": get_p("serviceName"),
+        "headerType": get_p("headerType", "none"),
+    }
+
+DEDUP_KEYS = ("address", "port", "uuid", "type", "security", "sni", "path", "pbk", "sid", "flow")
 
 def compare_proxies(p1, p2):
     if not p1 or not p2: return False
-    keys_to_compare = ["address", "port", "uuid", "type", "security", "sni", "path", "pbk", "sid", "flow"]
-    for key in keys_to_compare:
+    for key in DEDUP_KEYS:
         if p1.get(key) != p2.get(key): return False
     return True
 
 def deduplicate(live_results):
+    # Ключ — кортеж тех же полей, что сравнивает compare_proxies: один проход по словарю вместо O(n²)
     unique_list = []
-    seen_parsed = []
+    seen = set()
     for url, ms in live_results:
         p_current = parse_vless(url)
         if not p_current: continue
-        is_duplicate = False
-        for p_seen in seen_parsed:
-            if compare_proxies(p_current, p_seen):
-                is_duplicate = True
-                break
-        if not is_duplicate:
+        key = tuple(p_current.get(k) for k in DEDUP_KEYS)
+        if key not in seen:
+            seen.add(key)
             unique_list.append((url, ms))
-            seen_parsed.append(p_current)
     return unique_list
 
 def make_full_config(p, local_port):
@@ -111,7 +127,7 @@ def make_full_config(p, local_port):
     elif p["type"] == "tcp" and p["headerType"] != "none":
         stream["tcpSettings"] = {"header": {"type": p["headerType"]}}
     return {
-        "log": {"loglevel": "none"},
+        "log": xray_ready.XRAY_LOG,
         "inbounds": [{"port": local_port, "listen": "127.0.0.1", "protocol": "socks"}],
         "outbounds": [{
             "protocol": "vless",
@@ -120,68 +136,220 @@ def make_full_config(p, local_port):
         }]
     }
 
+def make_tagged_outbound(p, tag):
+    """Outbound из make_full_config с тегом — для батч-конфига из Uidd_gen_work."""
+    if not p: return None
+    outbound = make_full_config(p, 0)["outbounds"][0]
+    outbound["tag"] = tag
+    return outbound
+
 def is_port_open(port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.settimeout(0.1)
         return s.connect_ex(('127.0.0.1', port)) == 0
 
-def check_single_proxy(url, index, core_path, temp_dir):
+def start_core(core_path, config_path):
+    # Запуск с подавлением окон в Windows
+    startupinfo = None
+    if os.name == 'nt':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    # stdout xray читает xray_ready: готовность по строке «Xray ... started»
+    return xray_ready.start([core_path, "run", "-c", config_path], startupinfo=startupinfo)
+
+def stop_core(proc):
+    try:
+        proc.kill()  # ПРИНУДИТЕЛЬНОЕ УБИЙСТВО
+        proc.wait(timeout=0.5) # Ждем освобождения ресурсов
+    except: pass
+
+def wait_ports(proc, ports, timeout=CORE_STARTUP_TIMEOUT):
+    """Ждёт, пока xray откроет все указанные порты (или умрёт / выйдет таймаут)."""
+    start_t = time.time()
+    pending = list(ports)
+    while True:
+        pending = [port for port in pending if not is_port_open(port)]
+        if not pending: return True
+        if proc.poll() is not None or time.time() - start_t >= timeout: return False
+        time.sleep(0.3)
+
+def start_core_ready(core_path, config_path, ports):
+    """start_core + ожидание готовности (xray_ready, опрос портов — запасной путь)
+    с адаптивным таймаутом старта; (proc, готов ли)."""
+    proc = start_core(core_path, config_path)
+    limit = startup_timeout.get()
+    start_t = time.perf_counter()
+    if xray_ready.wait_ready(proc, limit, lambda remaining: wait_ports(proc, ports, remaining)):
+        startup_timeout.observe(time.perf_counter() - start_t, limit)
+        return proc, True
+    if not xray_ready.exited(proc): startup_timeout.timed_out(limit)
+    return proc, False
+
+def probe_port(local_port, timeout=TIMEOUT_HTTP):
+    """Запрос к TEST_DOMAIN через socks-inbound (asyncio, см. socks_probe.py); задержка в мс или None."""
+    return socks_probe_port(local_port, TEST_DOMAIN, timeout)
+
+def check_batch(batch, core_path, temp_dir, timeout=TIMEOUT_HTTP):
+    """Один xray с inbound на каждый прокси батча; все прокси проверяются параллельно."""
+    global processed_count
+    try: return check_batch_part(batch, core_path, temp_dir, timeout)
+    finally:
+        with counter_lock: processed_count += len(batch)
+
+def check_batch_part(batch, core_path, temp_dir, timeout):
+    """Если xray с батчем упал на старте, батч делится пополам, пока виноватый не
+    останется один: "core" пишется только ему, а не всем соседям по батчу. Если xray
+    жив, но не успел подняться (таймаут старта уже учтён в start_core_ready), дело не
+    в ссылках — "core" получает весь батч, как в Uidd_gen_work."""
+    results = []
+    retry = None
+    proc = None
+    cfg_path = None
+    lease = port_pool.acquire(len(batch))
+    try:
+        cfg_path, mapping = create_batch_config_file(batch, lease.start, temp_dir,
+                                                     parse=parse_vless, outbound_factory=make_tagged_outbound)
+        if mapping:
+            proc, ready = start_core_ready(core_path, cfg_path, [mapping[0][1], mapping[-1][1]])
+            if ready:
+                # Все порты батча — в одном event loop, без потока на проверку
+                t = min(timeout, http_timeout.get())
+                probes = asyncio.run(probe_many([m[1] for m in mapping], TEST_DOMAIN, t))
+                if any(r["error"] == "timeout" for r in probes): http_timeout.timed_out(t, timeout)
+                for (url, _, p), r in zip(mapping, probes):
+                    store_writer.add(url, r["latency"] if r["ok"] else None, r["error"])
+                    if not r["ok"]:
+                        with counter_lock: xray_errors[classify_error(r["error"])] += 1
+                        continue
+                    ms = r["latency"]
+                    http_timeout.observe(ms / 1000, t)
+                    results.append((url, ms))
+                    with print_lock:
+                        print(f"LIVE | {p['address']:<20} | {ms:>4}ms | {p['type']}")
+            elif len(mapping) > 1 and xray_ready.exited(proc):
+                retry = [url for url, _, _ in mapping]
+            else:
+                for url, _, _ in mapping:
+                    store_writer.add(url, error="core")
+                with counter_lock: xray_errors["core"] += len(mapping)
+    except: pass
+    finally:
+        if proc: stop_core(proc)
+        lease.release(proc)
+        if cfg_path:
+            try: os.remove(cfg_path)
+            except: pass
+    if retry:
+        half = len(retry) // 2
+        results += check_batch_part(retry[:half], core_path, temp_dir, timeout)
+        results += check_batch_part(retry[half:], core_path, temp_dir, timeout)
+    return results
+
+def check_single_proxy(url, index, core_path, temp_dir, timeout=TIMEOUT_HTTP):
     global processed_count
     p = parse_vless(url)
     if not p: return None
-    local_port = 10000 + (index % 45000)
+    lease = port_pool.acquire(1)
+    local_port = lease.start
     config_path = os.path.join(temp_dir, f"cfg_{index}.json")
     proc = None
     res = None
     try:
         with open(config_path, "w") as f: json.dump(make_full_config(p, local_port), f)
-        
-        # Запуск с подавлением окон в Windows
-        startupinfo = None
-        if os.name == 'nt':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-
-        proc = subprocess.Popen(
-            [core_path, "run", "-c", config_path], 
-            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-            startupinfo=startupinfo
-        )
-        
-        start_t = time.time()
-        ready = False
-        while time.time() - start_t < CORE_STARTUP_TIMEOUT:
-            if is_port_open(local_port):
-                ready = True
-                break
-            if proc.poll() is not None: break
-            time.sleep(0.3)
+        proc, ready = start_core_ready(core_path, config_path, [local_port])
 
         if ready:
-            proxies = {"http": f"socks5h://127.0.0.1:{local_port}", "https": f"socks5h://127.0.0.1:{local_port}"}
-            st = time.time()
-            try:
-                r = requests.get(TEST_DOMAIN, proxies=proxies, timeout=TIMEOUT_HTTP, verify=False)
-                if r.status_code == 204:
-                    ms = int((time.time() - st) * 1000)
-                    res = (url, ms)
-                    with print_lock:
-                        print(f"LIVE | {p['address']:<20} | {ms:>4}ms | {p['type']}")
-            except: pass
+            t = min(timeout, http_timeout.get())
+            start_t = time.perf_counter()
+            ms = probe_port(local_port, t)
+            store_writer.add(url, ms)
+            if ms is None and time.perf_counter() - start_t >= t * 0.95: http_timeout.timed_out(t, timeout)
+            if ms is not None:
+                http_timeout.observe(ms / 1000, t)
+                res = (url, ms)
+                with print_lock:
+                    print(f"LIVE | {p['address']:<20} | {ms:>4}ms | {p['type']}")
+            else:
+                with counter_lock: xray_errors["timeout/http"] += 1
+        else:
+            store_writer.add(url, error="core")
+            with counter_lock: xray_errors["core"] += 1
     except: pass
     finally:
-        if proc:
-            try:
-                proc.kill()  # ПРИНУДИТЕЛЬНОЕ УБИЙСТВО
-                proc.wait(timeout=0.5) # Ждем освобождения ресурсов
-            except: pass
+        if proc: stop_core(proc)
+        lease.release(proc)
         try: os.remove(config_path)
         except: pass
         with counter_lock: processed_count += 1
     return res
 
+def run_checks_local(proxies, timeout, core, temp_dir, threads=THREADS):
+    """Проверяет список прокси с данным таймаутом в этом процессе; [(url, ms)] живых."""
+    live = []
+    if not proxies: return live
+    if BATCH_MODE:
+        # THREADS делится между батчами: каждый батч сам держит BATCH_SIZE проверок
+        batches = [proxies[i:i + BATCH_SIZE] for i in range(0, len(proxies), BATCH_SIZE)]
+        workers = max(1, threads // BATCH_SIZE)
+        print(f"Батчевый режим: {len(batches)} батчей по {BATCH_SIZE}, {workers} xray одновременно, таймаут {timeout} с")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(check_batch, batch, core, temp_dir, timeout)
+                for batch in batches
+            ]
+            for f in as_completed(futures):
+                live.extend(f.result())
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = [executor.submit(check_single_proxy, url, i, core, temp_dir, timeout) for i, url in enumerate(proxies)]
+            for f in as_completed(futures):
+                result = f.result()
+                if result: live.append(result)
+    return live
+
+class ShardWriter:
+    """store_writer в шарде: каждая проверка уходит родителю сообщением, пишет он."""
+    def __init__(self, emit): self.emit = emit
+
+    def add(self, url, latency=None, error=None): self.emit(("probe", url, latency, error))
+
+def check_shard(shard, proxies, ports, emit, timeout, core, temp_dir, threads):
+    """Процесс-шард (shard_pool.py): свой диапазон портов, свои xray и таймауты."""
+    global port_pool, store_writer
+    port_pool = PortPool(*ports)
+    store_writer = ShardWriter(emit)
+    shard_dir = os.path.join(temp_dir, f"shard{shard}")  # cfg_{index}.json у шардов совпадают
+    os.makedirs(shard_dir, exist_ok=True)
+    run_checks_local(proxies, timeout, core, shard_dir, threads)
+    emit(("summary", dict(xray_errors),
+          [http_timeout.summary(), startup_timeout.summary(), xray_ready.summary(), port_pool.summary()]))
+
+def run_checks(proxies, timeout, core, temp_dir):
+    """Проверяет список прокси с данным таймаутом; [(url, ms)] живых.
+    При нескольких ядрах — шардами по процессам; живые и ошибки приходят сообщениями."""
+    global processed_count
+    unit = BATCH_SIZE if BATCH_MODE else 1
+    shards = shard_count(SHARDS, -(-len(proxies) // unit))
+    if shards == 1: return run_checks_local(proxies, timeout, core, temp_dir)
+
+    # THREADS — общий бюджет, делится между шардами
+    threads = max(unit, THREADS // shards)
+    print(f"Шардов: {shards}, потоков в каждом: {threads}")
+    live = []
+    for shard, message in run_sharded(check_shard, proxies, shards, args=(timeout, core, temp_dir, threads),
+                                      unit=unit, ports=(LOCAL_PORT_START, PORT_LAST)):
+        if message[0] == "probe":
+            _, url, latency, error = message
+            store_writer.add(url, latency, error)
+            if latency is not None: live.append((url, latency))
+            with counter_lock: processed_count += 1
+        elif message[0] == "summary":
+            xray_errors.update(message[1])
+            shard_summaries.extend(f"шард {shard} (таймаут {timeout} с): {line}" for line in message[2])
+    return live
+
 def main():
-    global total_proxies_count
+    global total_proxies_count, store_writer
     core = shutil.which("xray") or "./xray"
     
     # Очистка старых процессов xray перед запуском
@@ -196,15 +364,41 @@ def main():
     if total_proxies_count == 0: return
 
     temp_dir = tempfile.mkdtemp()
+    store_writer = ResultsWriter("work_test", track_streaks=True)
     print(f"Проверка {total_proxies_count} прокси в {THREADS} потоках...")
 
-    all_live = []
-    with ThreadPoolExecutor(max_workers=THREADS) as executor:
-        futures = [executor.submit(check_single_proxy, url, i, core, temp_dir) for i, url in enumerate(proxies)]
-        for f in as_completed(futures):
-            result = f.result()
-            if result: all_live.append(result)
+    # Расписание по истории (retest_schedule.py): стабильные — быстрой проверкой,
+    # давно мёртвые — с экспоненциальной паузой, остальные — полной
+    store = ResultsStore()
+    plan = plan_retests(proxies, load_histories(store), int(time.time()))
+    store.close()
+    print(f"Расписание: {plan.summary()}")
+
+    # Воронка (reach_probe.py): tcp -> tls/reality без xray, до xray доходят выжившие
+    reachable, stages = prefilter(plan.quick + plan.full, on_fail=lambda url, error: store_writer.add(url, error=error))
+    reachable = set(reachable)
+    plan.quick = [url for url in plan.quick if url in reachable]
+    plan.full = [url for url in plan.full if url in reachable]
+    for stats in stages: print(stats.summary())
+
+    xray_stats = StageStats("xray", THREADS, TIMEOUT_HTTP)
+    xray_start = time.perf_counter()
+    all_live = run_checks(plan.quick, QUICK_TIMEOUT, core, temp_dir)
+    quick_live = {url for url, _ in all_live}
+    retry = [url for url in plan.quick if url not in quick_live]
+    if plan.quick:
+        print(f"Быстрая проверка: живых {len(quick_live)} из {len(plan.quick)}, "
+              f"на полную перепроверку: {len(retry)}")
+    all_live += run_checks(retry + plan.full, TIMEOUT_HTTP, core, temp_dir)
+    xray_stats.elapsed = time.perf_counter() - xray_start
+    xray_stats.total, xray_stats.passed = len(reachable), len(all_live)
+    xray_stats.check_ms = [ms for _, ms in all_live]
+    xray_stats.errors = xray_errors
+    xray_stats.groups = count_endpoints(reachable)
+    xray_stats.groups_passed = count_endpoints(url for url, _ in all_live)
+    stages.append(xray_stats)
 
+    store_writer.close()
     all_live.sort(key=lambda x: x[1])
     final_proxies = deduplicate(all_live)
 
@@ -215,6 +409,16 @@ def main():
     try: shutil.rmtree(temp_dir)
     except: pass
 
+    print("\nВоронка:")
+    for stats in stages: print("  " + stats.summary())
+    if shard_summaries:
+        for line in shard_summaries: print("  " + line)
+    else:
+        print("Таймауты:")
+        print("  " + http_timeout.summary())
+        print("  " + startup_timeout.summary())
+        print(xray_ready.summary())
+        print(port_pool.summary())
     print(f"\nНайдено живых: {len(all_live)}")
     print(f"После дедупликации: {len(final_proxies)}")
     print(f"Результат сохранен в {OUTPUT_FILE}")
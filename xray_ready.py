@@ -0,0 +1,207 @@
+# =============================================================================
+# Готовность xray по строке запуска вместо опроса портов
+# =============================================================================
+# Когда все inbound'ы слушают, xray пишет в лог «Xray X.Y.Z started» (уровень
+# warning, поэтому в конфигах XRAY_LOG вместо loglevel none). Процесс
+# запускается со stdout в pipe; один общий поток на selectors читает pipe
+# всех запущенных xray: встретил строку — будит ждущего через Event, дальше
+# просто вычитывает вывод до EOF, чтобы xray не встал на заполненном pipe.
+# Ждущий спит на Event, без циклов со sleep и без сокетов на каждую попытку.
+# Прежний опрос портов остаётся запасным путём: на Windows (select там не
+# работает с pipe) и если xray строку не печатает (другая версия, другой
+# уровень лога). Пока это не известно, ждущий раз в UNKNOWN_CHECK с проверяет
+# порты; открыты, а строки нет и через столько же — до конца запуска все
+# ждут опросом.
+# Время от запуска процесса до готовности копится для сводки.
+# =============================================================================
+
+import os
+import re
+import selectors
+import subprocess
+import threading
+import time
+
+# ------------------------------- НАСТРОЙКИ -------------------------------
+READY_RE   = re.compile(rb"Xray \S+ started")
+XRAY_LOG   = {"loglevel": "warning", "access": "none"}   # "log" для конфигов xray
+USE_SIGNAL = os.name != "nt"
+TAIL_BYTES = 256          # сколько хвоста вывода держать для поиска строки на стыке чтений
+UNKNOWN_CHECK = 1.0       # с; как часто проверять порты, пока не знаем, будет ли строка
+EXIT_GRACE = 1.0          # с; сколько ждать завершения xray, закрывшего вывод
+
+
+class Startup:
+    """Состояние запуска одного xray: ready/exited выставляет поток-читатель."""
+
+    def __init__(self, watched):
+        self.started_at = time.perf_counter()
+        self.watched = watched
+        self.ready = False
+        self.exited = False
+        self.changed = threading.Event()
+        self.tail = b""
+
+
+class _Watcher:
+    """Один поток на все pipe: selectors + self-pipe, чтобы подхватывать новые процессы."""
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        threading.Thread(target=self._run, name="xray-ready", daemon=True).start()
+
+    def watch(self, stream, startup):
+        with self.lock:
+            self.selector.register(stream, selectors.EVENT_READ, startup)
+        os.write(self.wake_w, b"\0")
+
+    def _run(self):
+        while True:
+            for key, _ in self.selector.select():
+                if key.fd == self.wake_r:
+                    try:
+                        os.read(self.wake_r, 4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                self._read(key)
+
+    def _read(self, key):
+        startup = key.data
+        try:
+            data = os.read(key.fd, 65536)
+        except OSError:
+            data = b""
+        if not data:
+            with self.lock:
+                self.selector.unregister(key.fileobj)
+            key.fileobj.close()
+            startup.exited = True
+            startup.changed.set()
+            return
+        if startup.ready:
+            return
+        buf = startup.tail + data
+        if READY_RE.search(buf):
+            startup.ready = True
+            startup.tail = b""
+            startup.changed.set()
+        else:
+            startup.tail = buf[-TAIL_BYTES:]
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+_signal_seen = None        # None — ещё не знаем, печатает ли этот xray строку запуска
+stats = {"signal": [], "poll": [], "failed": 0}
+stats_lock = threading.Lock()
+
+
+def _get_watcher():
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = _Watcher()
+        return _watcher
+
+
+def start(cmd, startupinfo=None):
+    """Popen xray; при USE_SIGNAL stdout/stderr идут в общий поток-читатель.
+
+    Состояние запуска — в атрибуте proc.xray_startup.
+    """
+    watched = USE_SIGNAL and _signal_seen is not False
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE if watched else subprocess.DEVNULL,
+        stderr=subprocess.STDOUT if watched else subprocess.DEVNULL,
+        startupinfo=startupinfo,
+    )
+    proc.xray_startup = Startup(watched)
+    if watched:
+        _get_watcher().watch(proc.stdout, proc.xray_startup)
+    return proc
+
+
+def _record(how, startup):
+    with stats_lock:
+        if how:
+            stats[how].append(time.perf_counter() - startup.started_at)
+        else:
+            stats["failed"] += 1
+
+
+def wait_ready(proc, timeout, poll):
+    """Ждёт готовности xray не дольше timeout от вызова.
+
+    poll(remaining) — прежний опрос портов, True/False; с remaining=0 проверяет
+    один раз. Возвращает "signal", "poll" или None (не поднялся / умер).
+    """
+    global _signal_seen
+    startup = getattr(proc, "xray_startup", None) or Startup(False)
+    if startup.watched:
+        deadline = time.perf_counter() + timeout
+        ports_open_at = None
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            if _signal_seen is False:          # другой ждущий уже выяснил, что строки не будет
+                ready = poll(remaining)
+                _record("poll" if ready else None, startup)
+                return "poll" if ready else None
+            if startup.changed.wait(remaining if _signal_seen else min(remaining, UNKNOWN_CHECK)):
+                break
+            if _signal_seen is None and poll(0):
+                now = time.perf_counter()
+                if ports_open_at is None:
+                    ports_open_at = now        # строка могла просто не успеть — ждём ещё
+                elif now - ports_open_at >= UNKNOWN_CHECK:
+                    _signal_seen = False       # порты открыты, строки нет: этот xray её не печатает
+                    _record("poll", startup)
+                    return "poll"
+        if startup.ready:
+            _signal_seen = True
+            _record("signal", startup)
+            return "signal"
+        if not startup.exited and proc.poll() is None and poll(0):
+            _record("poll", startup)
+            return "poll"
+        _record(None, startup)
+        return None
+    ready = poll(timeout)
+    _record("poll" if ready else None, startup)
+    return "poll" if ready else None
+
+
+def exited(proc):
+    """Завершился ли xray. Вывод закрывается чуть раньше, чем процесс становится
+    виден poll(): если EOF уже был, процесс коротко дожидается."""
+    if proc.poll() is not None:
+        return True
+    startup = getattr(proc, "xray_startup", None)
+    if startup is None or not startup.exited:
+        return False
+    try:
+        proc.wait(EXIT_GRACE)
+    except subprocess.TimeoutExpired:
+        return False
+    return True
+
+
+def summary():
+    """Строка для итогов: сколько xray поднялось по сигналу/опросом и за сколько."""
+    with stats_lock:
+        parts = []
+        for how, name in (("signal", "по строке запуска"), ("poll", "опросом портов")):
+            times = sorted(stats[how])
+            if times:
+                parts.append(f"{name} {len(times)}, медиана {times[len(times) // 2] * 1000:.0f} мс, "
+                             f"p95 {times[int(len(times) * 0.95)] * 1000:.0f} мс")
+        if stats["failed"]:
+            parts.append(f"не поднялось {stats['failed']}")
+        return "готовность xray: " + ("; ".join(parts) if parts else "запусков не было")